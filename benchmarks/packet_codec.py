@@ -0,0 +1,67 @@
+# Compares the compiled packet codecs against the old per-call struct.pack/unpack implementation.
+# Run it from the repository root with "python benchmarks/packet_codec.py".
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import packet
+
+def legacy_string_to_bytes(string):
+    return f"{string: <64}".encode("cp437")
+
+def legacy_bytes_to_string(string):
+    return string.decode("cp437").strip()
+
+class LegacyPacket:
+    def __init__(self, packet_id: int, augment: str):
+        self.packet_id = packet_id
+        self.augment   = "!" + augment
+        self.size      = packet.get_size(self.augment)
+
+    def to_bytes(self, *args):
+        return struct.pack(self.augment, self.packet_id, *[
+            legacy_string_to_bytes(i) if isinstance(i, str) else i
+            for i in args
+        ])
+
+    def from_bytes(self, data):
+        if data[0] != self.packet_id:
+            raise packet.InvalidPacketError(f"First byte of the packet must be {self.packet_id} but it's {data[0]}")
+        
+        return [legacy_bytes_to_string(i) if isinstance(i, bytes) and len(i) == 64 else i
+                for i in struct.unpack(self.augment, data)]
+
+def run(label, statement, number):
+    seconds = min(timeit.repeat(statement, number=number, repeat=5))
+    print(f"{label:<40} {seconds / number * 1e9:8.0f} ns/call")
+
+def main():
+    number = 200000
+
+    cases = [
+        (packet.position_orientation_packet, (3, 1024, 2048, 4096, 64, 32)),
+        (packet.server_set_block_packet,     (10, 20, 30, 4)),
+        (packet.message_packet,              (255, "&7[Guest] someone: hello world")),
+    ]
+
+    for new, args in cases:
+        old    = LegacyPacket(new.packet_id, new.augment[1:])
+        data   = new.to_bytes(*args)
+        buffer = bytearray(new.size * 16)
+        view   = memoryview(buffer)
+
+        assert old.to_bytes(*args) == data
+        assert list(new.from_bytes(data)) == old.from_bytes(data)
+
+        print(f"{new.name} ({new.size} bytes)")
+        run("  legacy to_bytes",           lambda: old.to_bytes(*args),                  number)
+        run("  compiled to_bytes",         lambda: new.to_bytes(*args),                  number)
+        run("  compiled pack_into",        lambda: new.pack_into(buffer, 64, *args),     number)
+        run("  legacy from_bytes",         lambda: old.from_bytes(data),                 number)
+        run("  compiled unpack_from (memoryview)", lambda: new.unpack_from(view, 64),    number)
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import threading
+
 import constants
 
 COLLIDE_AIR = 0
@@ -24,6 +26,11 @@ BLOCK_DRAW_SOLID = 0
 BLOCK_DRAW_GLASS = 1
 BLOCK_DRAW_LEAVES = 2
 BLOCK_DRAW_AIR = 3
+BLOCK_DRAW_TRANSLUCENT = 4
+
+PERMISSION_INVALID = 0
+PERMISSION_DENIED = 1
+PERMISSION_ALLOWED = 2
 
 class BlockType:
     def __init__(self, block_id, name="Invalid", min_rank=0, fallback=0,
@@ -70,6 +77,12 @@ cobble_block  = BlockType(block_id=4, name="Cobblestone", min_rank=constants.RAN
 wood_block    = BlockType(block_id=5, name="Wood",        min_rank=constants.RANK_GUEST,    fallback=5,                collide=COLLIDE_SOLID, toptex=4,  lefttex=4,  righttex=4,  fronttex=4,  backtex=4,  bottomtex=4,  sound=SOUND_WOOD,   block_draw=BLOCK_DRAW_SOLID)
 sapling_block = BlockType(block_id=6, name="Sapling",     min_rank=constants.RANK_GUEST,    fallback=6, is_cube=False, collide=COLLIDE_AIR,                                       fronttex=15,                           sound=SOUND_GRASS,  block_draw=BLOCK_DRAW_SOLID)
 bedrock_block = BlockType(block_id=7, name="Bedrock",     min_rank=constants.RANK_OPERATOR, fallback=7,                collide=COLLIDE_SOLID, toptex=17, lefttex=17, righttex=17, fronttex=17, backtex=17, bottomtex=17, sound=SOUND_STONE,  block_draw=BLOCK_DRAW_SOLID)
+water_block   = BlockType(block_id=8, name="Water",       min_rank=constants.RANK_BUILDER,  fallback=8,                collide=COLLIDE_WATER, toptex=14, lefttex=14, righttex=14, fronttex=14, backtex=14, bottomtex=14, sound=SOUND_NONE,   block_draw=BLOCK_DRAW_TRANSLUCENT, blocks_light=False)
+still_water   = BlockType(block_id=9, name="Still water", min_rank=constants.RANK_BUILDER,  fallback=9,                collide=COLLIDE_WATER, toptex=14, lefttex=14, righttex=14, fronttex=14, backtex=14, bottomtex=14, sound=SOUND_NONE,   block_draw=BLOCK_DRAW_TRANSLUCENT, blocks_light=False)
+lava_block    = BlockType(block_id=10, name="Lava",       min_rank=constants.RANK_BUILDER,  fallback=10,               collide=COLLIDE_LAVA,  toptex=30, lefttex=30, righttex=30, fronttex=30, backtex=30, bottomtex=30, sound=SOUND_NONE,   block_draw=BLOCK_DRAW_SOLID)
+still_lava    = BlockType(block_id=11, name="Still lava", min_rank=constants.RANK_BUILDER,  fallback=11,               collide=COLLIDE_LAVA,  toptex=30, lefttex=30, righttex=30, fronttex=30, backtex=30, bottomtex=30, sound=SOUND_NONE,   block_draw=BLOCK_DRAW_SOLID)
+sand_block    = BlockType(block_id=12, name="Sand",       min_rank=constants.RANK_GUEST,    fallback=12,               collide=COLLIDE_SOLID, toptex=18, lefttex=18, righttex=18, fronttex=18, backtex=18, bottomtex=18, sound=SOUND_SAND,   block_draw=BLOCK_DRAW_SOLID)
+gravel_block  = BlockType(block_id=13, name="Gravel",     min_rank=constants.RANK_GUEST,    fallback=13,               collide=COLLIDE_SOLID, toptex=19, lefttex=19, righttex=19, fronttex=19, backtex=19, bottomtex=19, sound=SOUND_GRAVEL, block_draw=BLOCK_DRAW_SOLID)
 
 blocks = {
     0: air_block,
@@ -80,6 +93,45 @@ blocks = {
     5: wood_block,
     6: sapling_block,
     7: bedrock_block,
+    8: water_block,
+    9: still_water,
+    10: lava_block,
+    11: still_lava,
+    12: sand_block,
+    13: gravel_block,
 }
 
-block_id_type = int
\ No newline at end of file
+block_id_type = int
+
+class BlockRegistry:
+    def __init__(self, blocks):
+        self.blocks = dict(blocks)
+        self.lock   = threading.Lock()
+
+        self.rebuild()
+
+    def rebuild(self):
+        # Replaced rather than cleared, so a lookup running at the same time still sees a complete set of tables
+        self.tables = {}  # Rank number -> 256 PERMISSION_ values, one per block ID, built the first time that rank is looked up
+
+    def add(self, block_type: BlockType):
+        with self.lock:
+            self.blocks[block_type.block_id] = block_type
+            self.rebuild()
+
+    def remove(self, block_id: block_id_type):
+        with self.lock:
+            del self.blocks[block_id]
+            self.rebuild()
+
+    def permissions(self, rank_num: int) -> bytes:
+        tables = self.tables
+        table  = tables.get(rank_num)
+
+        if table is None:
+            table = bytes(PERMISSION_INVALID if i not in self.blocks else
+                          PERMISSION_ALLOWED if rank_num >= self.blocks[i].min_rank else
+                          PERMISSION_DENIED for i in range(256))
+            tables[rank_num] = table
+
+        return table
@@ -0,0 +1,137 @@
+import threading
+
+# Handlers run from the lowest priority to the highest, handlers with the same priority in the order they subscribed
+PRIORITY_FIRST  = 0
+PRIORITY_EARLY  = 1
+PRIORITY_NORMAL = 2
+PRIORITY_LATE   = 3
+PRIORITY_LAST   = 4
+
+class Event:
+    __slots__   = ("cancelled",)
+    cancellable = False
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        if not self.cancellable:
+            raise TypeError(f"{type(self).__name__} can't be cancelled")
+
+        self.cancelled = True
+
+class BlockPlaceEvent(Event):
+    # Placing and breaking, breaking places air. Handlers can change new, cancelling puts the old block back for the player
+    __slots__   = ("player", "world", "x", "y", "z", "old", "new")
+    cancellable = True
+
+    def __init__(self, player, world, x, y, z, old, new):
+        self.cancelled = False
+        self.player    = player
+        self.world     = world
+        self.x         = x
+        self.y         = y
+        self.z         = z
+        self.old       = old
+        self.new       = new
+
+class MoveEvent(Event):
+    # Position in blocks, like Player.x, y and z. Cancelling teleports the player back to where they were
+    __slots__   = ("player", "x", "y", "z", "yaw", "pitch")
+    cancellable = True
+
+    def __init__(self, player, x, y, z, yaw, pitch):
+        self.cancelled = False
+        self.player    = player
+        self.x         = x
+        self.y         = y
+        self.z         = z
+        self.yaw       = yaw
+        self.pitch     = pitch
+
+class ChatEvent(Event):
+    # Only chat, not commands. Handlers can change message
+    __slots__   = ("player", "message")
+    cancellable = True
+
+    def __init__(self, player, message):
+        self.cancelled = False
+        self.player    = player
+        self.message   = message
+
+class JoinEvent(Event):
+    # Before the player is added to the server, cancelling disconnects them with reason
+    __slots__   = ("player", "reason")
+    cancellable = True
+
+    def __init__(self, player):
+        self.cancelled = False
+        self.player    = player
+        self.reason    = "&cYou can't join this server"
+
+class LeaveEvent(Event):
+    __slots__ = ("player",)
+
+    def __init__(self, player):
+        self.cancelled = False
+        self.player    = player
+
+class WorldLoadEvent(Event):
+    __slots__ = ("world",)
+
+    def __init__(self, world):
+        self.cancelled = False
+        self.world     = world
+
+events = [BlockPlaceEvent, MoveEvent, ChatEvent, JoinEvent, LeaveEvent, WorldLoadEvent]
+
+class EventBus:
+    def __init__(self, logger):
+        self.logger        = logger
+        self.lock          = threading.Lock()
+        self.subscriptions = {}                                 # Event type -> list of (priority, order, handler)
+        self.handlers      = {i: () for i in events}            # Event type -> its handlers, sorted. Only rebuilt when someone subscribes or unsubscribes
+        self.order         = 0
+
+    def subscribe(self, event_type, handler, priority=PRIORITY_NORMAL):
+        with self.lock:
+            self.order += 1
+            self.subscriptions.setdefault(event_type, []).append((priority, self.order, handler))
+            self.rebuild(event_type)
+
+    def unsubscribe(self, event_type, handler):
+        with self.lock:
+            subscriptions = self.subscriptions.get(event_type, [])
+
+            for i, subscription in enumerate(subscriptions):
+                if subscription[2] == handler:
+                    del subscriptions[i]
+                    break
+            else:
+                raise ValueError(f"{handler} isn't subscribed to {event_type.__name__}")
+
+            self.rebuild(event_type)
+
+    def rebuild(self, event_type):
+        # A new tuple is swapped in, so a fire that's already going through the old one isn't affected
+        self.handlers[event_type] = tuple(handler for _, _, handler in sorted(self.subscriptions[event_type], key=lambda i: i[:2]))
+
+    def fire(self, event_type, *args):
+        # Returns the event after every handler has seen it, or None without creating it when nothing is subscribed
+        handlers = self.handlers.get(event_type)
+
+        if not handlers:
+            return None
+
+        this_event = event_type(*args)
+
+        for handler in handlers:
+            try:
+                handler(this_event)
+            except Exception:
+                self.logger.exception(f"Error in {event_type.__name__} handler {handler}")
+
+            if this_event.cancelled:
+                break
+
+        return this_event
@@ -0,0 +1,377 @@
+import array
+import bisect
+import collections
+import itertools
+import operator
+import os
+import struct
+import sys
+import threading
+import time
+
+RECORD = struct.Struct("!IIIBBB")  # Time, player ID, block index, old block, new block, kind
+
+KIND_PLACE    = 0
+KIND_UNDO     = 1
+KIND_REDO     = 2
+KIND_ROLLBACK = 3
+KIND_DRAWN    = 4  # The rest of a bulk edit, its first block is KIND_PLACE. /undo and /redo take the whole edit back at once
+
+Change = collections.namedtuple("Change", "time uid index old new kind")
+
+def pack_records(now: int, uid: int, indexes: list, old: bytes, new: bytes, kind: int) -> bytearray:
+    # The same as packing every record on its own, but filled in a field at a time with strided slices
+    count   = len(indexes)
+    records = bytearray(count * RECORD.size)
+    fields  = RECORD.pack(now, uid, 0, 0, 0, kind)
+
+    column  = array.array("I", indexes)
+
+    if sys.byteorder == "little":
+        column.byteswap()
+
+    column  = column.tobytes()
+
+    for i in (0, 1, 2, 3, 4, 5, 6, 7, 14):
+        records[i::RECORD.size] = fields[i:i + 1] * count
+
+    for i in range(4):
+        records[8 + i::RECORD.size] = column[i::4]
+
+    records[12::RECORD.size] = old
+    records[13::RECORD.size] = new
+
+    return records
+
+def unpack_records(data):
+    # The opposite of pack_records, the (block indexes, old blocks, new blocks) of the records in data
+    column = bytearray(len(data) // RECORD.size * 4)
+
+    for i in range(4):
+        column[i::4] = data[8 + i::RECORD.size]
+
+    indexes = array.array("I", column)
+
+    if sys.byteorder == "little":
+        indexes.byteswap()
+
+    return indexes, bytes(data[12::RECORD.size]), bytes(data[13::RECORD.size])
+
+def runs(indexes, first: bytes, second: bytes):
+    # Splits records into runs of consecutive block indexes, as (start index, first's blocks, second's blocks)
+    if not indexes:
+        return []
+
+    breaks = list(itertools.compress(range(1, len(indexes)), map(operator.ne, indexes[1:], map(operator.add, indexes, itertools.repeat(1)))))
+    bounds = [0] + breaks + [len(indexes)]
+
+    return [(indexes[a], first[a:b], second[a:b]) for a, b in zip(bounds, bounds[1:])]
+
+class WorldHistory:
+    SEGMENT_RECORDS = 65536  # Records kept in memory before they're written to the history file
+    REGION_SIZE     = 16
+
+    def __init__(self, path: str, width: int, length: int):
+        self.path      = path
+        self.width     = width
+        self.length    = length
+
+        self.lock      = threading.RLock()
+        self.segment   = bytearray()  # Records that haven't been written to the file yet
+        self.spilled   = 0            # How many records are in the file
+
+        # Record numbers, oldest first, so finding what someone did never means reading the whole history
+        self.by_player = {}           # Player ID -> their own edits
+        self.by_region = {}           # (x, y, z) of a REGION_SIZE cube -> every change inside of it
+        self.edits     = {}           # Player ID -> where in by_player each of their edits starts, a bulk edit is one edit
+
+        self.cursors   = {}           # Player ID -> how many of their edited blocks haven't been undone
+        self.redoable  = {}           # Player ID -> how many undone blocks can still be redone
+
+        if os.path.exists(path):
+            self.load()
+
+        self.file = open(path, "ab+")
+
+    def __len__(self):
+        return self.spilled + len(self.segment) // RECORD.size
+
+    def load(self):
+        # Only the indexes are rebuilt, the records themselves stay in the file
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        data = data[:len(data) - len(data) % RECORD.size]  # A torn record at the end is dropped
+
+        for number, (_, uid, index, _, _, kind) in enumerate(RECORD.iter_unpack(data)):
+            self.index(number, uid, index, kind)
+
+        self.spilled = len(data) // RECORD.size
+        self.cursors = {uid: len(records) for uid, records in self.by_player.items()}
+
+    def index(self, number: int, uid: int, index: int, kind: int):
+        self.by_region.setdefault(self.region(index), array.array("I")).append(number)
+
+        if kind == KIND_PLACE:
+            self.edits.setdefault(uid, array.array("I")).append(len(self.by_player.get(uid, ())))
+
+        if kind in (KIND_PLACE, KIND_DRAWN):
+            self.by_player.setdefault(uid, array.array("I")).append(number)
+
+    def region(self, index: int):
+        y, rest = divmod(index, self.width * self.length)
+        z, x    = divmod(rest, self.width)
+
+        return x // self.REGION_SIZE, y // self.REGION_SIZE, z // self.REGION_SIZE
+
+    def add(self, uid: int, index: int, old: int, new: int, kind: int = KIND_PLACE):
+        with self.lock:
+            number = len(self)
+
+            if kind == KIND_PLACE:
+                self.drop_undone(uid)
+
+            self.segment += RECORD.pack(int(time.time()), uid, index, old, new, kind)
+            self.index(number, uid, index, kind)
+
+            if kind == KIND_PLACE:
+                self.cursors[uid]  = len(self.by_player[uid])
+                self.redoable[uid] = 0
+
+            if len(self.segment) >= self.SEGMENT_RECORDS * RECORD.size:
+                self.spill()
+
+    def add_rows(self, uid: int, rows, kind: int = KIND_PLACE):
+        # Records a bulk edit in one go. rows are (start index, old blocks, new blocks), only the blocks that differ are recorded.
+        # The records and their regions are worked out before taking the lock, so single blocks recorded meanwhile aren't held up
+        now     = int(time.time())
+        records = bytearray()
+        regions = []  # (region, first record, end), counted from the first record of this edit
+
+        for start, old, new in rows:
+            differs = list(map(operator.ne, old, new))
+            indexes = list(itertools.compress(range(start, start + len(old)), differs))
+            first   = len(records) // RECORD.size
+
+            records += pack_records(now, uid, indexes, bytes(itertools.compress(old, differs)), bytes(itertools.compress(new, differs)),
+                                    KIND_DRAWN if kind == KIND_PLACE else kind)
+
+            # Consecutive changes share a region until the row crosses into the next REGION_SIZE columns or the next line
+            i = 0
+
+            while i < len(indexes):
+                x   = indexes[i] % self.width
+                end = bisect.bisect_left(indexes, indexes[i] + min(self.REGION_SIZE - x % self.REGION_SIZE, self.width - x), i)
+
+                regions.append((self.region(indexes[i]), first + i, first + end))
+                i = end
+
+        if not records:
+            return
+
+        if kind == KIND_PLACE:
+            records[14] = KIND_PLACE
+
+        with self.lock:
+            number = len(self)
+            count  = len(records) // RECORD.size
+
+            self.segment += records
+
+            for region, first, end in regions:
+                self.by_region.setdefault(region, array.array("I")).extend(range(number + first, number + end))
+
+            if kind == KIND_PLACE:
+                self.drop_undone(uid)
+                placed = self.by_player.setdefault(uid, array.array("I"))
+
+                self.edits.setdefault(uid, array.array("I")).append(len(placed))
+                placed.extend(range(number, number + count))
+
+                self.cursors[uid]  = len(placed)
+                self.redoable[uid] = 0
+
+            if len(self.segment) >= self.SEGMENT_RECORDS * RECORD.size:
+                self.spill()
+
+    def drop_undone(self, uid: int):
+        # A new edit means whatever was undone before it can't be redone anymore, so it's taken out of the player's edits
+        placed = self.by_player.get(uid)
+        cursor = self.cursors.get(uid)
+
+        if placed is not None and cursor is not None and cursor < len(placed):
+            del placed[cursor:]
+            del self.edits[uid][bisect.bisect_left(self.edits[uid], cursor):]
+
+    def spill(self):
+        with self.lock:
+            if self.segment:
+                self.file.write(self.segment)
+                self.file.flush()
+
+                self.spilled += len(self.segment) // RECORD.size
+                self.segment.clear()
+
+    def get(self, number: int) -> Change:
+        with self.lock:
+            if number >= self.spilled:
+                return Change._make(RECORD.unpack_from(self.segment, (number - self.spilled) * RECORD.size))
+
+            self.file.seek(number * RECORD.size)
+
+            return Change._make(RECORD.unpack(self.file.read(RECORD.size)))
+
+    def read(self, numbers) -> bytes:
+        # The records with these numbers, in order. Consecutive numbers are read together, so a bulk edit is read in one go
+        parts = []
+
+        with self.lock:
+            i = 0
+
+            while i < len(numbers):
+                if numbers[-1] - numbers[i] == len(numbers) - 1 - i:
+                    j = len(numbers)
+                else:
+                    j = i + 1
+
+                    while j < len(numbers) and numbers[j] == numbers[j - 1] + 1:
+                        j += 1
+
+                first, last = numbers[i], numbers[i] + j - i
+
+                if first < self.spilled:
+                    self.file.seek(first * RECORD.size)
+                    parts.append(self.file.read((min(last, self.spilled) - first) * RECORD.size))
+
+                if last > self.spilled:
+                    parts.append(bytes(self.segment[max(first - self.spilled, 0) * RECORD.size:(last - self.spilled) * RECORD.size]))
+
+                i = j
+
+        return b"".join(parts)
+
+    def spans(self, uid: int, start: int, end: int):
+        # Positions start to end of the player's edited blocks split up into their edits, as (start, end) pairs, oldest first
+        edits  = self.edits.get(uid, ())
+        bounds = [start] + list(edits[bisect.bisect_right(edits, start):bisect.bisect_left(edits, end)]) + [end]
+
+        return list(zip(bounds, bounds[1:]))
+
+    def revert(self, this_world, uid: int, spans, forwards: bool, kind: int, by_uid: int):
+        # Applies or takes back the edits in spans, one edit at a time, a row of blocks at a time. Blocks someone else changed since are left alone.
+        # Returns how many blocks changed and the (start index, old blocks, new blocks) of every row that did
+        # Each edit is read when it's its turn, so undoing a lot of big edits doesn't read all of them into memory at once
+        with self.lock:
+            records = self.by_player.get(uid, array.array("I"))
+
+        count  = 0
+        edited = []
+
+        for start, end in spans if forwards else reversed(spans):
+            indexes, old, new = unpack_records(self.read(records[start:end]))
+
+            if forwards:
+                count += this_world.restore_rows(runs(indexes, old, new), edited)
+            else:
+                # Backwards within the edit too, in case it changed a block more than once
+                count += this_world.restore_rows(runs(indexes, new, old)[::-1], edited)
+
+        self.add_rows(by_uid, edited, kind)
+
+        return count, edited
+
+    def undo(self, this_world, uid: int, count: int):
+        # Takes back the player's last count edits, a bulk edit counts as one. Blocks someone else changed since are left alone, but still count as undone.
+        # Returns how many blocks changed and the (start index, old blocks, new blocks) of every row that did
+        with self.lock:
+            records = self.by_player.get(uid, ())
+            edits   = self.edits.get(uid, ())
+            cursor  = self.cursors.get(uid, len(records))
+            before  = bisect.bisect_left(edits, cursor)  # Edits that start before the cursor
+            target  = edits[max(before - count, 0)] if before and count else cursor
+            spans   = self.spans(uid, target, cursor)
+
+            self.cursors[uid]  = target
+            self.redoable[uid] = self.redoable.get(uid, 0) + cursor - target
+
+        return self.revert(this_world, uid, spans, False, KIND_UNDO, uid)
+
+    def redo(self, this_world, uid: int, count: int):
+        with self.lock:
+            records = self.by_player.get(uid, ())
+            edits   = self.edits.get(uid, ())
+            cursor  = self.cursors.get(uid, len(records))
+            after   = bisect.bisect_right(edits, cursor)  # The first edit that starts after the cursor
+            target  = edits[after + count - 1] if count and after + count <= len(edits) else len(records)
+            target  = min(target, cursor + self.redoable.get(uid, 0)) if count else cursor
+            spans   = self.spans(uid, cursor, target)
+
+            self.cursors[uid]  = target
+            self.redoable[uid] = self.redoable.get(uid, 0) - (target - cursor)
+
+        return self.revert(this_world, uid, spans, True, KIND_REDO, uid)
+
+    def rollback(self, this_world, uid: int, since: float, by_uid: int):
+        # Reverts every edit the player made at or after since, newest first
+        with self.lock:
+            records = self.by_player.get(uid, array.array("I"))
+            cursor  = self.cursors.get(uid, len(records))
+            start   = bisect.bisect_left(range(cursor), since, key=lambda i: self.get(records[i]).time)
+            spans   = self.spans(uid, start, cursor)
+
+            # Rolled back edits can't be brought back with /redo
+            self.cursors[uid]  = start
+            self.redoable[uid] = 0
+
+        return self.revert(this_world, uid, spans, False, KIND_ROLLBACK, by_uid)
+
+    def changes_at(self, index: int, limit: int):
+        # The newest changes to one block, found through its region so only changes near it are read
+        changes = []
+
+        with self.lock:
+            for number in reversed(self.by_region.get(self.region(index), ())):
+                change = self.get(number)
+
+                if change.index == index:
+                    changes.append(change)
+
+                    if len(changes) == limit:
+                        break
+
+        return changes
+
+    def close(self):
+        self.spill()
+        self.file.close()
+
+class HistoryStore:
+    def __init__(self, folder: str):
+        self.folder    = folder
+        self.histories = {}
+        self.lock      = threading.Lock()
+
+    def path(self, name):
+        return f"{self.folder}/{name}.history"
+
+    def get(self, this_world) -> WorldHistory:
+        # Opened the first time something in the world changes, or someone asks about it
+        with self.lock:
+            if this_world.name not in self.histories:
+                self.histories[this_world.name] = WorldHistory(self.path(this_world.name), this_world.width, this_world.length)
+
+            return self.histories[this_world.name]
+
+    def spill(self, name):
+        with self.lock:
+            history = self.histories.get(name)
+
+        if history is not None:
+            history.spill()
+
+    def close(self, name):
+        with self.lock:
+            history = self.histories.pop(name, None)
+
+        if history is not None:
+            history.close()
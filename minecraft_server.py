@@ -1,7 +1,11 @@
 from __future__ import annotations
+import collections
+import concurrent.futures
 import datetime
 import logging
+import multiprocessing
 import os
+import random
 import socket
 import threading
 import time
@@ -10,12 +14,21 @@ import tomllib
 import block
 import command
 import constants
+import event
+import history
+import network
 import packet
+import physics
 import player
+import player_slots
+import player_store
+import plugin_manager
 import world
 import rank
+import template
 import world_generator
-import world
+import world_manager
+import world_store
 
 class MinecraftServer:
     def __init__(self, logs_folder, config_folder, players_folder, worlds_folder, plugins_folder):
@@ -32,16 +45,59 @@ class MinecraftServer:
         self.formatter            = logging.Formatter("[%(levelname)-8s @ %(asctime)s] %(message)s", 
                                                       "%H:%M:%S")
         self.commands             = {}
-        self.loaded_plugins       = {}
-        self.loaded_worlds        = {}
+        self.events               = event.EventBus(self.logger)
+        self.templates            = template.TemplateEngine({})
+        self.plugin_manager       = plugin_manager.PluginManager(self)
+        self.loaded_plugins       = self.plugin_manager.plugins
+        self.loaded_worlds        = collections.OrderedDict()  # Least recently used first
+        self.world_manager        = world_manager.WorldManager(self)
+
+        self.generation_workers   = 0     # 0 uses every core
+        self.generation_pool      = None
+        self.generation_executor  = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="generate")
+        self.generating_worlds    = set()
+        self.level_executor       = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="level")
+        self.edit_executor        = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="edit")  # One worker applies bulk edits in the order they were made
+        self.editing              = {}    # World name -> bulk edits queued or running on it, guarded by load_lock. Those worlds aren't unloaded
+        self.load_lock            = threading.RLock()  # Guards loaded_worlds. Taken after world_lock and before save_lock when they're needed together
+        self.world_store          = world_store.WorldStore(worlds_folder)
+        self.history              = history.HistoryStore(worlds_folder)
+        self.autosave_interval    = 300
+        self.save_executor        = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="world-save")  # One worker keeps every world's writes in order
+        self.save_lock            = threading.Lock()
+        self.save_stats           = collections.deque(maxlen=20)
         self.ranks                = {}
 
         self.online_players       = {}
-        self.used_player_ids      = []
+        self.player_store         = player_store.PlayerStore(players_folder)
+        self.world_players        = {}
+        self.world_lock           = threading.RLock()
+        self.player_slots         = player_slots.SlotAllocator()
+        self.view_distance        = 0
+        self.network              = None
+        self.send_queue_limit     = 16777216
+
+        self.tps                  = 20
+        self.ticks                = 0
+        self.tick_times           = collections.deque(maxlen=100)
+        self.block_updates        = {}    # World name -> set block packets from bulk edits that still have to be sent
+        self.block_update_lock    = threading.Lock()
+        self.resending            = set() # Worlds whose map is being sent again, their block updates wait until it's been sent
+        self.block_update_rate    = 2048  # Blocks per tick
+        self.resend_threshold     = 65536
+        self.physics              = physics.Physics(self)
+
+        self.packet_handlers      = {  # Client packet ID -> handler(player, packet), packets without one are ignored
+            packet.client_set_block_packet.packet_id:     self.handle_set_block,
+            packet.position_orientation_packet.packet_id: self.handle_position,
+            packet.message_packet.packet_id:              self.handle_message,
+        }
+        self.packet_stats         = network.PacketStats()
 
         self.version              = (0, 0, 1)
   
-        self.blocks               = dict(block.blocks)
+        self.block_registry       = block.BlockRegistry(block.blocks)
+        self.blocks               = self.block_registry.blocks
     
     def start(self):
         
@@ -64,6 +120,28 @@ class MinecraftServer:
             self.server_config = tomllib.load(f)
         
         self.ranks = rank.load(f"{self.config_folder}/ranks.toml")
+        self.templates = template.TemplateEngine(self.server_config["colors"])
+
+        self.player_store.open()
+
+        self.send_queue_limit = self.server_config["server"].get("send_queue_limit", self.send_queue_limit)
+        self.tps              = self.server_config["server"].get("tps", self.tps)
+        self.view_distance    = self.server_config["server"].get("view_distance", self.view_distance)
+        self.player_slots.limit = self.server_config["server"].get("max_players", self.player_slots.limit)
+        self.block_update_rate = self.server_config["server"].get("block_update_rate", self.block_update_rate)
+        self.resend_threshold  = self.server_config["server"].get("resend_threshold", self.resend_threshold)
+        self.physics.budget    = self.server_config["server"].get("physics_budget", self.physics.budget)
+        self.autosave_interval = self.server_config["server"].get("autosave_interval", self.autosave_interval)
+        self.generation_workers = self.server_config["server"].get("generation_workers", self.generation_workers)
+
+        # Spawned rather than forked, a fork of a process with this many threads can inherit locks nothing will ever release
+        self.generation_pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.generation_workers or None, mp_context=multiprocessing.get_context("spawn"))
+
+        self.world_store.mmap_threshold = self.server_config["server"].get("mmap_threshold", self.world_store.mmap_threshold)
+
+        self.world_manager.memory_limit  = self.server_config["server"].get("world_memory_limit",  self.world_manager.memory_limit)
+        self.world_manager.idle_timeout  = self.server_config["server"].get("world_idle_timeout",  self.world_manager.idle_timeout)
+        self.world_manager.warm_worlds   = self.server_config["server"].get("warm_worlds",         self.world_manager.warm_worlds)
         
         #match self.server_config:
         #    case {
@@ -76,13 +154,14 @@ class MinecraftServer:
         
         if not self.world_exists(self.server_config["server"]["main_world"]):
             self.logger.info("Main world does not exist, creating it.")
-            self.make_world(self.server_config["server"]["main_world"], 128, 128, 128)
+            generator = world_generator.generators[self.server_config["server"].get("world_generator", "flat")]
+            self.make_world(self.server_config["server"]["main_world"], 128, 128, 128, generator=generator, seed=random.getrandbits(32))
         self.load_world(self.server_config["server"]["main_world"])
 
-        error = self.load_plugin("core")
-        if error != "":
+        errors = self.plugin_manager.load_all()
+        if "core" in errors or "core" not in self.loaded_plugins:
             logging.fatal("@@@@@@@@ FAILED TO LOAD CORE PLUGIN @@@@@@@@")
-            logging.fatal(error)
+            logging.fatal(errors.get("core", "core plugin not found"))
             logging.fatal("@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@")
 
         print(self.commands, self.ranks)
@@ -90,6 +169,19 @@ class MinecraftServer:
         ping_thread = threading.Thread(target=self.ping)
         ping_thread.start()
 
+        tick_thread = threading.Thread(target=self.tick_loop)
+        tick_thread.start()
+
+        if self.autosave_interval > 0:
+            autosave_thread = threading.Thread(target=self.autosave_loop, daemon=True)
+            autosave_thread.start()
+
+        world_manager_thread = threading.Thread(target=self.world_manager.run, daemon=True)
+        world_manager_thread.start()
+
+        player_store_thread = threading.Thread(target=self.player_store_loop)
+        player_store_thread.start()
+
         #heartbeat_thread = threading.Thread(target=self.heartbeat_do)
         #heartbeat_thread.start()
 
@@ -98,11 +190,313 @@ class MinecraftServer:
 
     def ping(self):
         while self.running:            
-            for k,v in dict(self.online_players).items():
+            for v in list(self.online_players.values()):
                 v.send_bytes(packet.ping_packet.to_bytes())
             
             time.sleep(1)
     
+    def player_store_loop(self):
+        while self.running:
+            time.sleep(self.player_store.flush_interval)
+            self.player_store.flush()
+
+        self.player_store.close()
+
+    def autosave_loop(self):
+        next_save = time.monotonic() + self.autosave_interval
+
+        while self.running:
+            time.sleep(1)
+
+            if time.monotonic() >= next_save:
+                self.save_worlds_in_background()
+                next_save = time.monotonic() + self.autosave_interval
+
+    def tick_loop(self):
+        next_tick = time.perf_counter()
+
+        while self.running:
+            start = time.perf_counter()
+
+            try:
+                self.tick()
+            except Exception:
+                self.logger.exception("Error while running a server tick")
+
+            self.ticks += 1
+            self.tick_times.append(time.perf_counter() - start)
+
+            next_tick += 1 / self.tps
+            delay      = next_tick - time.perf_counter()
+
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.perf_counter()  # Running behind, skip the missed ticks instead of running them all at once
+
+    def tick(self):
+        self.broadcast_movement()
+        self.physics.tick()
+        self.send_block_updates()
+
+    def edit_regions(self, world_name, boxes, table, uid=0):
+        # Runs every block in each (x1, y1, z1, x2, y2, z2) box through table on the edit thread, see edit_world.
+        # Every changed block goes into the world's history as an edit by uid
+        def edit(this_world):
+            count  = 0
+            edited = []
+
+            for box in boxes:
+                count += this_world.translate_region(*box, table, limit=0, edited=edited)[0]
+
+            self.history.get(this_world).add_rows(uid, edited)
+
+            return count, edited
+
+        return self.edit_world(world_name, edit)
+
+    def edit_world(self, world_name, edit):
+        # Runs edit(world) on the edit thread, so a big edit doesn't hold up the thread handling packets. edit returns how many blocks changed
+        # and the (start index, old blocks, new blocks) rows translate_region hands back. Physics is woken for those, and they're either queued
+        # to be sent a few thousand per tick, or the whole map is resent if so much changed that streaming it would take longer.
+        # Returns a future of how many blocks changed
+        this_world = self.get_world(world_name)
+
+        with self.load_lock:
+            self.editing[world_name] = self.editing.get(world_name, 0) + 1
+
+        def run():
+            try:
+                count, edited = edit(this_world)
+
+                self.physics.rows_changed(this_world, edited)
+
+                if count > self.resend_threshold:
+                    self.resend_world(world_name)
+                else:
+                    self.send_block_changes(world_name, [(start + i, b) for start, old, new in edited for i, (a, b) in enumerate(zip(old, new)) if a != b])
+
+                return count
+            finally:
+                with self.load_lock:
+                    self.editing[world_name] -= 1
+
+                    if not self.editing[world_name]:
+                        del self.editing[world_name]
+
+                self.world_manager.touch(world_name)
+
+        return self.edit_executor.submit(run)
+
+    def send_block_changes(self, world_name, changed):
+        # changed is a list of (block index, block ID), they're sent with the rest of the queued block updates
+        if changed:
+            this_world = self.get_world(world_name)
+            self.queue_block_updates(world_name, b"".join(packet.server_set_block_packet.to_bytes(*this_world.position(index), block_id) for index, block_id in changed))
+
+    def queue_block_updates(self, world_name, data):
+        with self.block_update_lock:
+            self.block_updates.setdefault(world_name, bytearray()).extend(data)
+
+    def send_block_updates(self):
+        batches = []
+
+        with self.block_update_lock:
+            for world_name, pending in list(self.block_updates.items()):
+                if world_name in self.resending:
+                    continue
+
+                size = self.block_update_rate * packet.server_set_block_packet.size
+                batches.append((world_name, bytes(pending[:size])))
+                del pending[:size]
+
+                if not pending:
+                    del self.block_updates[world_name]
+
+        for world_name, data in batches:
+            for v in self.players_in(world_name):
+                v.send_bytes(data)
+
+    def resend_world(self, world_name):
+        # Sends the map again to everyone in it, keeping them where they are. The level stream is built on the level thread,
+        # and only then is world_lock taken, so movement keeps going while a big map is compressed
+        this_world = self.get_world(world_name)
+
+        def resend():
+            try:
+                with self.block_update_lock:
+                    self.resending.add(world_name)
+                    pending = self.block_updates.setdefault(world_name, bytearray())
+                    built   = len(pending)  # Everything queued so far has been applied to the world, so it's in the new copy
+
+                stream = this_world.level_stream()
+
+                with self.block_update_lock:
+                    self.resending.discard(world_name)
+                    after = bytes(self.block_updates.pop(world_name, pending)[built:])
+
+                with self.world_lock:
+                    members = self.world_players.get(world_name, {})
+
+                    for v in list(members.values()):
+                        v.send_bytes(packet.level_initilize_packet.to_bytes())
+                        v.send_bytes(stream)
+                        v.send_bytes(packet.level_finalize_packet.to_bytes(this_world.width, this_world.height, this_world.length))
+                        v.send_bytes(packet.position_orientation_packet.to_bytes(255, *v.sent_position))
+
+                        # Loading a map removes every other player on the client, so the ones it could see are spawned again
+                        for player_id in v.viewers:
+                            if player_id in members:
+                                other = members[player_id]
+                                v.send_bytes(packet.spawn_player_packet.to_bytes(other.player_id, other.username, *other.sent_position))
+
+                        # Changes queued while the stream was being built might not be in it
+                        v.send_bytes(after)
+            except Exception:
+                self.logger.exception(f"Error while resending world {world_name}")
+
+        return self.level_executor.submit(resend)
+
+    def broadcast_movement(self):
+        with self.world_lock:
+            for world_name in list(self.world_players):
+                players = self.players_in(world_name)
+                movers  = {}
+
+                for v in players:
+                    position = v.position()
+
+                    if position != v.sent_position:
+                        movers[v.player_id] = packet.movement_update(v.player_id, v.sent_position, position)
+                        v.sent_position     = position
+
+                if not movers:
+                    continue
+
+                if self.view_distance == 0:
+                    everything = b"".join(movers.values())
+
+                    for v in players:
+                        if v.player_id in movers:
+                            v.send_bytes(b"".join(data for player_id, data in movers.items() if player_id != v.player_id))
+                        else:
+                            v.send_bytes(everything)
+                else:
+                    self.broadcast_movement_in_view(world_name, players, movers)
+
+    def broadcast_movement_in_view(self, world_name, players, movers):
+        # Players only see the players within view_distance of them, so every player that moved gets spawned for the players
+        # that came into view, despawned for the ones that left it, and sent to the ones that can still see them
+        members   = self.world_players[world_name]
+        cell_size = self.view_distance * 32
+        grid      = {}
+        outgoing  = {}
+        spawned   = set()
+
+        for v in players:
+            grid.setdefault((v.sent_position[0] // cell_size, v.sent_position[2] // cell_size), []).append(v)
+
+        for v in players:
+            if v.player_id not in movers:
+                continue
+
+            cell_x     = v.sent_position[0] // cell_size
+            cell_z     = v.sent_position[2] // cell_size
+            candidates = {i.player_id: i for dx in (-1, 0, 1) for dz in (-1, 0, 1) for i in grid.get((cell_x + dx, cell_z + dz), ())}
+            candidates.update((i, members[i]) for i in v.viewers if i in members)
+
+            for other in candidates.values():
+                if other is v:
+                    continue
+
+                pair    = (min(v.player_id, other.player_id), max(v.player_id, other.player_id))
+                in_view = self.in_view(v, other)
+
+                if in_view and other.player_id not in v.viewers:
+                    self.spawn_pair(v, other)
+                    spawned.add(pair)
+                elif not in_view and other.player_id in v.viewers:
+                    self.despawn_pair(v, other)
+                elif in_view and pair not in spawned:
+                    outgoing.setdefault(other.player_id, [other]).append(movers[v.player_id])
+
+        for v, *data in outgoing.values():
+            v.send_bytes(b"".join(data))
+
+    def players_in(self, world_name):
+        return list(self.world_players.get(world_name, {}).values())
+
+    def in_view(self, a, b):
+        if self.view_distance == 0:
+            return True
+
+        dx = a.sent_position[0] - b.sent_position[0]
+        dy = a.sent_position[1] - b.sent_position[1]
+        dz = a.sent_position[2] - b.sent_position[2]
+
+        return dx * dx + dy * dy + dz * dz <= (self.view_distance * 32) ** 2
+
+    def spawn_pair(self, a, b):
+        a.send_bytes(packet.spawn_player_packet.to_bytes(b.player_id, b.username, *b.sent_position))
+        b.send_bytes(packet.spawn_player_packet.to_bytes(a.player_id, a.username, *a.sent_position))
+        a.viewers.add(b.player_id)
+        b.viewers.add(a.player_id)
+
+    def despawn_pair(self, a, b):
+        a.send_bytes(packet.despawn_player_packet.to_bytes(b.player_id))
+        b.send_bytes(packet.despawn_player_packet.to_bytes(a.player_id))
+        a.viewers.discard(b.player_id)
+        b.viewers.discard(a.player_id)
+
+    def join_world(self, this_player, world_name):
+        with self.world_lock:
+            this_player.world         = world_name
+            this_player.sent_position = this_player.position()
+
+            for v in self.players_in(world_name):
+                if self.in_view(this_player, v):
+                    self.spawn_pair(this_player, v)
+
+            self.world_players.setdefault(world_name, {})[this_player.player_id] = this_player
+
+    def leave_world(self, this_player):
+        with self.world_lock:
+            members = self.world_players.get(this_player.world, {})
+            members.pop(this_player.player_id, None)
+
+            for player_id in list(this_player.viewers):
+                if player_id in members:
+                    self.despawn_pair(this_player, members[player_id])
+
+            this_player.viewers.clear()
+
+            if not members:
+                self.world_players.pop(this_player.world, None)
+
+            self.world_manager.touch(this_player.world)
+
+    def change_world(self, this_player, world_name):
+        self.get_world(world_name)
+        self.leave_world(this_player)
+        self.send_world(this_player, world_name)
+
+    def send_world(self, this_player, world_name):
+        # Building the level stream of a big map that was just edited takes a while, so it's done on the level thread instead of
+        # the thread handling packets. The player joins the world once it's been sent, unless they disconnected in the meantime
+        this_world = self.get_world(world_name)
+
+        def send():
+            try:
+                this_world.send(this_player)
+
+                with self.world_lock:
+                    if self.online_players.get(this_player.username) is this_player:
+                        self.join_world(this_player, world_name)
+            except Exception:
+                self.logger.exception(f"Error while sending world {world_name} to {this_player.username}")
+
+        return self.level_executor.submit(send)
+
     def heartbeat_do(self, url: str):
         if url.startswith('http://'):
             url = url[7:]
@@ -158,229 +552,441 @@ class MinecraftServer:
     def stop(self):
         self.running = False
 
-    def get_free_player_id(self):
-        return min([i for i in range(128) if i not in self.used_player_ids])
+        if self.generation_pool is not None:
+            self.generation_pool.shutdown(cancel_futures=True)
 
     def listen(self):
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.socket.bind(("", self.server_config["server"]["port"]))
         self.socket.listen()
 
-        while self.running:
-            connection, address = self.socket.accept()
-
-            thread = threading.Thread(target=self.accept, args=(connection, address))
-            thread.start()
+        if self.server_config["server"].get("network_mode", "selectors") == "threaded":
+            while self.running:
+                sock, address = self.socket.accept()
+                connection    = network.ThreadedConnection(sock, address, self.send_queue_limit)
+
+                thread = threading.Thread(target=self.accept, args=(connection, address))
+                thread.start()
+        else:
+            self.network = network.SelectorNetwork(self, self.socket)
+            self.network.run()
         
         self.socket.close()
 
     def accept(self, connection, address):
-        this_player = None
-
         self.logger.info(f"{address} connected to the server")
 
         try:
-            data = b""
-            while len(data) < 131:
-                data += connection.recv(131-len(data))
-            
-            first_packet = packet.player_identification_packet.from_bytes(data)  # All complient clients should first send a player identification packet
-            
-            if first_packet[2] in self.online_players:
-                connection.send(packet.disconnect_packet.to_bytes("&3There is already a player with your username on this server"))
-                raise ValueError()
-                
+            while self.running and not connection.closing:
+                connection.receive.fill(connection.socket)
+                self.handle_received(connection)
+
+        except (OSError, ValueError) as e:
+            pass
+        except Exception:
+            self.logger.exception(f"Error while handling packets from {address}")
+
+        if connection.overflowed:
+            self.logger.warning(f"{address} was disconnected because its send queue passed {connection.queue_limit} bytes")
+        
+        if connection.player is not None:
+            self.logout_player(connection.player)
+        
+        connection.close()
+
+    def handle_received(self, connection):
+        while not connection.closing:
+            try:
+                batch = connection.receive.packets(packet.client_packets if connection.player is None else connection.player.c_packets)
+            except packet.InvalidPacketError as e:
+                connection.send(packet.disconnect_packet.to_bytes(str(e)))
+                raise
+
+            if not batch:
+                return
+
+            self.handle_packets(connection, batch)
+
+    def handle_packets(self, connection, batch):
+        # Each packet's handler is looked up in packet_handlers, so adding packet types doesn't make dispatching any of them slower.
+        # The batch's timings are added to the stats in one go at the end
+        handlers = self.packet_handlers
+        clock    = time.perf_counter_ns
+        timings  = []
+
+        try:
+            for this_packet in batch:
+                start = clock()
+
+                if connection.player is None:
+                    connection.player = self.login_player(connection, this_packet)
+                else:
+                    handler = handlers.get(this_packet[0])
+
+                    if handler is not None:
+                        handler(connection.player, this_packet)
+
+                timings.append((this_packet[0], clock() - start))
+        finally:
+            self.packet_stats.add(timings)
+
+    def login_player(self, connection, first_packet):
+        if first_packet[0] != packet.player_identification_packet.packet_id:  # All complient clients should first send a player identification packet
+            raise packet.InvalidPacketError(f"Expected a player identification packet but got packet {first_packet[0]}")
+        
+        if first_packet[2] in self.online_players:
+            connection.send(packet.disconnect_packet.to_bytes("&3There is already a player with your username on this server"))
+            raise ValueError()
+
+        # Taken before anything is loaded, so a full server turns away a flood of connections without touching the player store
+        player_id = self.player_slots.acquire()
+
+        if player_id is None:
+            self.logger.info(f"{first_packet[2]} couldn't join because the server is full")
+            connection.send(packet.disconnect_packet.to_bytes("&cThe server is full"))
+            raise ValueError()
+
+        try:
             if self.player_saved(first_packet[2]):
                 this_player = self.load_player(first_packet[2])
-                this_player.connection = connection
             else:
-                this_player = player.Player(first_packet[2], connection)
-                this_player.rank = self.ranks[max(i for i in self.ranks if i in self.ranks and i <= self.server_config["ranks"]["default"])]
+                this_player = self.new_player(first_packet[2])
+
+            this_player.connection = connection
 
             this_player.logins += 1
             this_player.world = self.server_config["server"]["main_world"]
 
             def message(msg):
-                this_player._message(this_player.format_r(self.format_message(msg)))
+                this_player._message(self.templates.compile(msg).render(this_player))
             
             this_player.message = message
 
-            self.logger.info(f"{first_packet[2]} connected to the server")
+            joined = self.events.fire(event.JoinEvent, this_player)
 
-            self.online_players[this_player.username] = this_player
-            this_player.player_id = self.get_free_player_id()
-            self.used_player_ids.append(this_player.player_id)
+            if joined is not None and joined.cancelled:
+                connection.send(packet.disconnect_packet.to_bytes(joined.reason))
+                raise ValueError()
+        except BaseException:
+            self.player_slots.release(player_id)
+            raise
 
-            self.loaded_worlds[self.server_config["server"]["main_world"]].send(this_player)
+        # Only once they're in, so a join that's refused or fails doesn't leave the name registered without anything saved
+        self.player_store.register(this_player)
 
-            for k, v in dict(self.online_players).items():
-                if v.player_id != this_player.player_id and v.world == this_player.world:
-                    v.send_bytes(packet.spawn_player_packet.to_bytes(this_player.player_id, this_player.username, int(this_player.x * 32), int(this_player.y * 32), int(this_player.z * 32), 0, 0))
-                    this_player.send_bytes(packet.spawn_player_packet.to_bytes(v.player_id, v.username, int(v.x * 32), int(v.y * 32), int(v.z * 32), 0, 0))
-                v.message(this_player.format_s(self.server_config["player"]["connect_message"]))
+        self.logger.info(f"{first_packet[2]} connected to the server")
 
-            while self.running:
-                this_packet = this_player.read_packet()
-
-                if this_packet[0] == packet.client_set_block_packet.packet_id:
-                    x = this_packet[1]
-                    y = this_packet[2]
-                    z = this_packet[3]
-
-                    if this_packet[5] in self.blocks:
-                        self.loaded_worlds[this_player.world].set_block(x, y, z, 0 if this_packet[4] == 0 else this_packet[5])
-
-                        for k,v in dict(self.online_players).items():
-                            if v.player_id != this_player.player_id and v.world == this_player.world:
-                                v.send_bytes(packet.server_set_block_packet.to_bytes(x, y, z, 0 if this_packet[4] == 0 else this_packet[5]))
-                        
-                    else:
-                        this_player.message(f"&cInvalid block type &d{this_packet[5]}")
-
-                        this_player.send_bytes(packet.server_set_block_packet.to_bytes(x, y, z, self.loaded_worlds[this_player.world].get_block(this_packet[1], this_packet[2], this_packet[3])))
-
-                elif this_packet[0] == packet.position_orientation_packet.packet_id:
-                    this_player.x = this_packet[2] / 32
-                    this_player.y = this_packet[3] / 32
-                    this_player.z = this_packet[4] / 32
-
-                    for k,v in dict(self.online_players).items():
-                        if v.player_id != this_player.player_id and v.world == this_player.world:
-                            v.send_bytes(packet.position_orientation_packet.to_bytes(this_player.player_id, int(this_player.x * 32), int(this_player.y * 32), int(this_player.z * 32), this_packet[5], this_packet[6]))
-                    
-                
-                elif this_packet[0] == packet.message_packet.packet_id:
-                    message = this_packet[2]
-
-                    if message[0] == '/':
-                        self.logger.info(f"{this_player.username} Used command \"{message}\"")
-                        cmdname, _, cmdargs = message[1:].partition(" ")
-
-                        if cmdname in self.commands:
-                            if this_player.rank.num >= self.commands[cmdname].minrank:
-                                self.commands[cmdname].onuse(this_player, cmdargs)
-                            else:
-                                min_rank = self.ranks[min(i for i in self.ranks if i in self.ranks and i >= self.commands[cmdname].minrank)]
-                                this_player.message(f"§errOnly {min_rank.color}{min_rank.name}§err+ can use §cmd/{cmdname}")
-                        else:
-                            this_player.message(f"§errInvalid command §nms{cmdname}")
-                    else:
-                        message = this_player.format_s(self.server_config["player"]["message_format"]).replace("%msg%", message)
-                        self.logger.info(message)
+        self.online_players[this_player.username] = this_player
+        this_player.player_id = player_id
 
-                        for k,v in dict(self.online_players).items():
-                            v.message(message)
-                    
-                elif this_packet is None:
-                    break
+        self.send_world(this_player, self.server_config["server"]["main_world"])
 
-        except (OSError, ValueError) as e:
-            pass
-        
-        if this_player is not None:
-            for k,v in dict(self.online_players).items():
-                if v.player_id != this_player.player_id:
-                    v.send_bytes(packet.despawn_player_packet.to_bytes(this_player.player_id))
-                    v.message(this_player.format_s(self.server_config["player"]["disconnect_message"]))
-                
-            self.logger.info(this_player.format_s(self.server_config["player"]["disconnect_message"]))
+        self.broadcast(self.server_config["player"]["connect_message"], this_player)
 
-            self.used_player_ids = [i for i in self.used_player_ids if i != this_player.player_id]
+        return this_player
 
-            self.save_player(this_player)
+    def handle_set_block(self, this_player, this_packet):
+        x = this_packet[1]
+        y = this_packet[2]
+        z = this_packet[3]
 
-            del self.online_players[this_player.username]
-        
-        connection.close()
+        this_world = self.loaded_worlds[this_player.world]
+
+        if not this_world.contains(x, y, z):
+            return
+
+        old_block  = this_world.get_block(x, y, z)
+        new_block  = 0 if this_packet[4] == 0 else this_packet[5]
+
+        # Breaking a block needs the same rank placing it does, blocks that aren't registered can always be broken
+        permission = self.block_registry.permissions(this_player.rank.num)[old_block if this_packet[4] == 0 else new_block]
+
+        if permission == block.PERMISSION_ALLOWED or (this_packet[4] == 0 and permission == block.PERMISSION_INVALID):
+            requested = new_block
+            placed    = self.events.fire(event.BlockPlaceEvent, this_player, this_world, x, y, z, old_block, new_block)
+
+            if placed is not None:
+                if placed.cancelled:
+                    this_player.send_bytes(packet.server_set_block_packet.to_bytes(x, y, z, old_block))
+                    return
+
+                new_block = placed.new
+
+            this_world.set_block(x, y, z, new_block)
+
+            if old_block != new_block:
+                self.history.get(this_world).add(this_player.uid, this_world.index(x, y, z), old_block, new_block)
+                self.physics.block_changed(this_world, this_world.index(x, y, z))
+
+            data = packet.server_set_block_packet.to_bytes(x, y, z, new_block)
+
+            if this_player.world in self.block_updates:
+                # Behind a bulk edit that's still being sent, so it can't get there before the edit overwrites it
+                self.queue_block_updates(this_player.world, data)
+            else:
+                for v in self.players_in(this_player.world):
+                    if v.player_id != this_player.player_id or new_block != requested:
+                        v.send_bytes(data)
             
-    def load_plugin(self, name) -> str:
-        if not os.path.exists(f"{self.plugins_folder}/{name}.py"):
-            return f"File \"{self.plugins_folder}/{name}.py\" not found"
+        else:
+            if permission == block.PERMISSION_INVALID:
+                this_player.message(f"&cInvalid block type &d{this_packet[5]}")
+            else:
+                this_player.message(f"&cYou can't {'break' if this_packet[4] == 0 else 'place'} &d{self.blocks[old_block if this_packet[4] == 0 else new_block].name}")
+
+            this_player.send_bytes(packet.server_set_block_packet.to_bytes(x, y, z, old_block))
+
+    def handle_position(self, this_player, this_packet):
+        moved = self.events.fire(event.MoveEvent, this_player, this_packet[2] / 32, this_packet[3] / 32, this_packet[4] / 32, this_packet[5], this_packet[6])
+
+        if moved is None:
+            this_player.x     = this_packet[2] / 32
+            this_player.y     = this_packet[3] / 32
+            this_player.z     = this_packet[4] / 32
+            this_player.yaw   = this_packet[5]
+            this_player.pitch = this_packet[6]
+        elif moved.cancelled:
+            this_player.send_bytes(packet.position_orientation_packet.to_bytes(255, int(this_player.x * 32), int(this_player.y * 32), int(this_player.z * 32), this_player.yaw, this_player.pitch))
+        else:
+            this_player.x     = moved.x
+            this_player.y     = moved.y
+            this_player.z     = moved.z
+            this_player.yaw   = moved.yaw
+            this_player.pitch = moved.pitch
+        # Other players get the new position on the next tick
+
+    def handle_message(self, this_player, this_packet):
+        message = this_packet[2]
+
+        if message.startswith('/'):
+            self.logger.info(f"{this_player.username} Used command \"{message}\"")
+            cmdname, _, cmdargs = message[1:].partition(" ")
+
+            if cmdname in self.commands:
+                if this_player.rank.num >= self.commands[cmdname].minrank:
+                    self.commands[cmdname].onuse(this_player, cmdargs)
+                else:
+                    min_rank = self.ranks[min(i for i in self.ranks if i in self.ranks and i >= self.commands[cmdname].minrank)]
+                    this_player.message(f"§errOnly {min_rank.color}{min_rank.name}§err+ can use §cmd/{cmdname}")
+            else:
+                this_player.message(f"§errInvalid command §nms{cmdname}")
+        else:
+            chat = self.events.fire(event.ChatEvent, this_player, message)
 
-        with open(f"{self.plugins_folder}/{name}.py") as f:
-            code = f.read(-1)
+            if chat is not None:
+                if chat.cancelled:
+                    return
 
-        try:
-            local_vars  = locals()
-            global_vars = globals()
+                message = chat.message
 
-            exec(code, global_vars, local_vars)
-            self.loaded_plugins[name] = local_vars["Plugin"](server=self)#, block=block, command=command, constants=constants, packet=packet, player=player, world=world, rank=rank, world_generator=world_generator, world=world)
+            self.logger.info(self.broadcast(self.server_config["player"]["message_format"], this_player, message).render())
 
-        except Exception as e:
-            return repr(e)
-        
-        return ""
+    def logout_player(self, this_player):
+        self.events.fire(event.LeaveEvent, this_player)
+
+        with self.world_lock:
+            # Both at once, so a world still being sent to the player on the level thread can't add them back to it
+            del self.online_players[this_player.username]
+            self.leave_world(this_player)
+
+        self.logger.info(self.broadcast(self.server_config["player"]["disconnect_message"], this_player, exclude=this_player).render())
+
+        self.player_slots.release(this_player.player_id)
+
+        self.save_player(this_player)
+            
+    def load_plugin(self, name) -> str:
+        # Also reloads the plugin if it's loaded already
+        return self.plugin_manager.load(name)
 
     def unload_plugin(self, name):
-        self.loaded_plugins[name].unload()
-        del self.loaded_plugins[name]
+        self.plugin_manager.unload(name)
     
     def add_command(self, cmd):
         if not isinstance(cmd, command.Command):
             raise TypeError("command must be a Command")
 
-        self.commands[cmd.name] = cmd
+        # Goes into the plugin manager's staged command table while a plugin is being loaded
+        self.plugin_manager.commands()[cmd.name] = cmd
+        self.plugin_manager.added(cmd.name)
     
     def remove_command(self, name):
-        del self.commands[name]
+        del self.plugin_manager.commands()[name]
+
+    def subscribe(self, event_type, handler, priority=event.PRIORITY_NORMAL):
+        # Handlers subscribed while a plugin is loading are removed again when it's unloaded
+        self.plugin_manager.subscribe(event_type, handler, priority)
+
+    def unsubscribe(self, event_type, handler):
+        self.plugin_manager.unsubscribe(event_type, handler)
+
+    def add_block(self, block_type):
+        if not isinstance(block_type, block.BlockType):
+            raise TypeError("block_type must be a BlockType")
+
+        self.block_registry.add(block_type)
+
+    def remove_block(self, block_id):
+        self.block_registry.remove(block_id)
 
     def get_world(self, name):
-        if name in self.loaded_worlds:
-            return self.loaded_worlds[name]
+        with self.load_lock:
+            if name not in self.loaded_worlds:
+                self.load_world(name)
 
-        self.load_world(name)
+            self.world_manager.touch(name)
 
-        return self.loaded_worlds[name]
+            return self.loaded_worlds[name]
     
     def load_world(self, name):
-        with open(f"{self.worlds_folder}/{name}", "rb") as f:
-            data = f.read()
-        
-        self.loaded_worlds[name] = world.World.from_bytes(data)
+        with self.load_lock:
+            self.loaded_worlds[name] = self.world_store.load(name)
+            self.world_manager.touch(name)
+
+        self.events.fire(event.WorldLoadEvent, self.loaded_worlds[name])
     
-    def make_world(self, name, width, height, length, motd="Welcome!", generator=world_generator.flat_world_generator):
-        this_world = world.World(name=name, width=width, height=height, length=length, motd=motd, generator=generator)
+    def make_world(self, name, width, height, length, motd="Welcome!", generator=world_generator.flat_world_generator, seed=0, progress=None):
+        # Big maps made by a registered generator are split across the generation pool, anything else is generated right here
+        if width * height * length >= world_generator.PARALLEL_THRESHOLD and generator in world_generator.generators.values():
+            started    = time.perf_counter()
+            this_world = world.World(name=name, width=width, height=height, length=length, motd=motd, generator=lambda width, height, length, seed: b'')
+
+            this_world.blocks = world_generator.generate_parallel(self.generation_pool, generator, width, height, length, seed,
+                                                                  chunks=(self.generation_workers or os.cpu_count() or 1) * 4, progress=progress)
+
+            self.logger.info(f"Generated {name} ({width}x{height}x{length}) in {time.perf_counter() - started:.2f}s")
+        else:
+            this_world = world.World(name=name, width=width, height=height, length=length, motd=motd, generator=generator, seed=seed)
+
+            if progress is not None:
+                progress(length, length)
         
-        with open(f"{self.worlds_folder}/{name}", "wb") as f:
-            f.write(this_world.to_bytes())
+        self.world_store.create(this_world)
+
+    def make_world_async(self, name, width, height, length, motd="Welcome!", generator=world_generator.flat_world_generator, seed=0, progress=None):
+        # Same as make_world, but returns a future right away so whoever asked for the world isn't stuck waiting for it
+        with self.load_lock:
+            if name in self.generating_worlds or self.world_exists(name):
+                raise ValueError(f"World {name} already exists")
+
+            self.generating_worlds.add(name)
+
+        def make():
+            try:
+                self.make_world(name, width, height, length, motd, generator, seed, progress)
+            finally:
+                with self.load_lock:
+                    self.generating_worlds.discard(name)
+
+        return self.generation_executor.submit(make)
     
     def save_world(self, name):
-        with open(f"{self.worlds_folder}/{name}", "wb") as f:
-            print(f.write(self.loaded_worlds[name].to_bytes()))
+        # Waits for the save, but it still goes through the save worker so it can't overtake an autosave of the same world
+        with self.load_lock:
+            this_world = self.loaded_worlds[name]
+
+        with self.save_lock:
+            future = self.submit_world_save(this_world)
+
+        return future.result()
+
+    def save_worlds_in_background(self):
+        futures = []
+
+        with self.load_lock:
+            loaded = list(self.loaded_worlds.values())
+
+        with self.save_lock:
+            for this_world in loaded:
+                if this_world.dirty:
+                    futures.append(self.submit_world_save(this_world))
+
+        return futures
+
+    def submit_world_save(self, this_world):
+        start = time.perf_counter()
+        save  = self.world_store.prepare(this_world)
+
+        return self.save_executor.submit(self.write_world_save, this_world, save, time.perf_counter() - start)
+
+    def write_world_save(self, this_world, save, snapshot_time):
+        start = time.perf_counter()
+
+        self.history.spill(save[0])
+
+        try:
+            written = self.world_store.write(save)
+        except OSError:
+            # The changes were already taken from the world, so the next save has to write all of it again.
+            # That also makes it a new snapshot, which puts the generation on disk back in line with the world's
+            with this_world.changes_lock:
+                this_world.dirty_all = True
+
+            self.logger.exception(f"Failed to save world {save[0]}")
+            raise
+
+        write_time = time.perf_counter() - start
+
+        self.save_stats.append((save[0], written, snapshot_time, write_time))
+        self.logger.info(f"Saved world {save[0]}: {written} bytes, snapshot took {snapshot_time * 1000:.1f}ms, writing took {write_time * 1000:.1f}ms")
+
+        return written
 
     def world_exists(self, name):
-        return name in os.listdir(self.worlds_folder)
+        return self.world_store.exists(name)
     
+    def new_player(self, name):
+        this_player      = player.Player(name, None)
+        this_player.rank = self.ranks[max(i for i in self.ranks if i in self.ranks and i <= self.server_config["ranks"]["default"])]
+
+        return this_player
+
     def load_player(self, name):
-        with open(f"{self.players_folder}/{name}", "rb") as f:
-            data = f.read()
-        
-        return player.Player.from_bytes(data, self.ranks)
+        # Someone whose name is registered but was never saved starts over as a new player
+        this_player = self.player_store.load(name, self.ranks)
+
+        if this_player is None:
+            this_player = self.new_player(name)
+            self.player_store.register(this_player)
+
+        return this_player
     
     def save_player(self, p):
-        with open(f"{self.players_folder}/{p.username}", "wb") as f:
-            print(f.write(p.to_bytes()))
+        self.player_store.save(p)
 
     def player_saved(self, name):
-        return name in os.listdir(self.players_folder)
+        return self.player_store.exists(name)
 
     def unload_world(self, name):
-        self.save_world(name)
-        
-        del self.loaded_worlds[name]
+        with self.load_lock:
+            self.save_world(name)
+            this_world = self.loaded_worlds.pop(name)
+
+        this_world.close()
+        self.history.close(name)
+        self.physics.forget(name)
     
     def format_message(self, message):
-        message = message.replace("§msg", self.server_config["colors"]["message"])
-        message = message.replace("§dft", self.server_config["colors"]["default"])
-        message = message.replace("§cmd", self.server_config["colors"]["commands"])
-        message = message.replace("§nms", self.server_config["colors"]["names"])
-        message = message.replace("§err", self.server_config["colors"]["errors"])
-        message = message.replace("§arg", self.server_config["colors"]["arguments"])
-        # :trollface:
-        message = message.replace("$ip", "I am an idiot and tried to use $ip")
-        message = message.replace("$skin", "I am an idiot and tried to use $skin")
-        # weird bug fix
-        message = message.replace("Â", "")
-        
-        return message
\ No newline at end of file
+        # Used for log lines, which are nearly all different, so they're parsed without going through the cache and pushing the chat templates out
+        return template.Template(self.templates.parse(message)).render()
+
+    def broadcast(self, text, sender=None, message=None, exclude=None, players=None):
+        # Sends a message to every online player (or just players). The packets are built once per distinct view of the template,
+        # which is once in total unless it uses the receiver's fields, and the same bytes are queued for everyone with that view
+        this_template = self.templates.compile(text).fill(sender, message)
+        encoded       = {}
+
+        for v in list(self.online_players.values()) if players is None else players:
+            if v is exclude:
+                continue
+
+            view = this_template.view(v)
+            data = encoded.get(view)
+
+            if data is None:
+                data = encoded[view] = player.message_bytes(this_template.render(v))
+
+            v.send_bytes(data)
+
+        return this_template
\ No newline at end of file
@@ -0,0 +1,365 @@
+import selectors
+import socket
+import threading
+
+import packet
+
+class ReceiveBuffer:
+    def __init__(self, size=65536):
+        self.buffer = bytearray(size)
+        self.view   = memoryview(self.buffer)
+        self.start  = 0
+        self.end    = 0
+
+    def fill(self, sock):
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buffer):
+            # Only the unfinished packet at the end gets moved back to the front
+            self.view[:self.end - self.start] = self.view[self.start:self.end]
+            self.end  -= self.start
+            self.start = 0
+
+        received = sock.recv_into(self.view[self.end:])
+
+        if received == 0:
+            raise ConnectionError("connection closed by the client")
+
+        self.end += received
+
+    def packets(self, c_packets):
+        # Decodes every complete packet in one pass. An unknown packet ID is only raised once the packets before it have been handed out
+        batch = []
+        start = self.start
+
+        while start < self.end:
+            packet_id = self.view[start]
+
+            if packet_id not in c_packets:
+                if batch:
+                    break
+
+                raise packet.InvalidPacketError(f"Invalid packet {packet_id}!")
+
+            packet_ = c_packets[packet_id]
+
+            if self.end - start < packet_.size:
+                break
+
+            batch.append(packet_.unpack_from(self.view, start))
+            start += packet_.size
+
+        self.start = start
+
+        return batch
+
+class PacketStats:
+    BUCKETS = 40  # Handling times go in power of two buckets of nanoseconds, bucket i counts the ones under 2**i ns
+
+    def __init__(self):
+        self.lock       = threading.Lock()
+        self.counts     = {}  # Packet ID -> how many have been handled
+        self.times      = {}  # Packet ID -> nanoseconds spent handling them in total
+        self.histograms = {}  # Packet ID -> list of BUCKETS counts
+
+    def add(self, timings):
+        # timings is the (packet ID, nanoseconds) of every packet in a batch
+        with self.lock:
+            for packet_id, elapsed in timings:
+                if packet_id not in self.counts:
+                    self.counts[packet_id]     = 0
+                    self.times[packet_id]      = 0
+                    self.histograms[packet_id] = [0] * self.BUCKETS
+
+                self.counts[packet_id] += 1
+                self.times[packet_id]  += elapsed
+                self.histograms[packet_id][min(elapsed.bit_length(), self.BUCKETS - 1)] += 1
+
+    def percentile(self, packet_id, fraction):
+        # Upper bound in nanoseconds of the bucket the packet at fraction (0.99 for the 99th percentile) falls in
+        with self.lock:
+            histogram = self.histograms[packet_id]
+            target    = fraction * self.counts[packet_id]
+            seen      = 0
+
+            for i, count in enumerate(histogram):
+                seen += count
+
+                if seen >= target:
+                    return 2 ** i
+
+        return 2 ** (self.BUCKETS - 1)
+
+class Connection:
+    def __init__(self, sock, address, queue_limit):
+        self.socket       = sock
+        self.address      = address
+        self.player       = None
+        self.receive      = ReceiveBuffer()
+
+        self.outbound     = bytearray()
+        self.in_flight    = 0
+        self.lock         = threading.Lock()
+        self.closing      = False
+        self.overflowed   = False
+        self.queue_limit  = queue_limit
+
+        self.bytes_queued = 0
+        self.bytes_sent   = 0
+        self.sends        = 0
+        self.peak_queue   = 0
+
+    @property
+    def queue_depth(self):
+        return len(self.outbound) + self.in_flight
+
+    def send(self, data):
+        with self.lock:
+            if self.closing:
+                return
+
+            overflowed = len(self.outbound) + self.in_flight + len(data) > self.queue_limit
+
+            if overflowed:
+                # The client isn't reading fast enough to ever catch up, so stop queueing for it and disconnect it
+                self.outbound.clear()
+                self.overflowed = True
+                self.closing    = True
+            else:
+                self.outbound     += data
+                self.bytes_queued += len(data)
+                self.peak_queue    = max(self.peak_queue, len(self.outbound) + self.in_flight)
+
+        if overflowed:
+            self.abort()
+
+        self.wake()
+
+    def close(self):
+        # The socket is only closed by the writer, once everything queued before this call has been written
+        with self.lock:
+            self.closing = True
+
+        self.wake()
+
+    def wake(self):
+        pass
+
+    def abort(self):
+        pass
+
+class SelectorConnection(Connection):
+    def __init__(self, network, sock, address, queue_limit):
+        super().__init__(sock, address, queue_limit)
+
+        self.network = network
+
+    def wake(self):
+        self.network.wake(self)
+
+class ThreadedConnection(Connection):
+    def __init__(self, sock, address, queue_limit):
+        super().__init__(sock, address, queue_limit)
+
+        self.ready  = threading.Condition(self.lock)
+        self.writer = threading.Thread(target=self.drain, daemon=True)
+        self.writer.start()
+
+    def wake(self):
+        with self.ready:
+            self.ready.notify()
+
+    def abort(self):
+        # The writer can be stuck in sendall to a client that stopped reading, and the reader in recv.
+        # Shutting the socket down makes both of them return, so the player is logged out straight away
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def drain(self):
+        try:
+            while True:
+                with self.ready:
+                    while not self.outbound and not self.closing:
+                        self.ready.wait()
+
+                    if not self.outbound:
+                        break
+
+                    # Everything queued so far goes out in one write, without holding the lock so senders never wait on the socket
+                    data, self.outbound = self.outbound, bytearray()
+                    self.in_flight = len(data)
+
+                self.socket.sendall(data)
+
+                with self.lock:
+                    self.in_flight   = 0
+                    self.bytes_sent += len(data)
+                    self.sends      += 1
+        except OSError:
+            pass
+
+        with self.lock:
+            self.outbound.clear()
+            self.in_flight = 0
+            self.closing   = True
+
+        # Shutting the socket down wakes up the reading thread if the server is the one closing the connection
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        self.socket.close()
+
+class SelectorNetwork:
+    def __init__(self, server, listen_socket):
+        self.server        = server
+        self.listen_socket = listen_socket
+        self.selector      = selectors.DefaultSelector()
+        self.connections   = {}
+
+        self.pending       = set()
+        self.pending_lock  = threading.Lock()
+        self.thread        = None
+
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+
+    def wake(self, connection):
+        with self.pending_lock:
+            if connection in self.pending:
+                return
+
+            self.pending.add(connection)
+
+        if threading.current_thread() is not self.thread:
+            try:
+                self.wake_writer.send(b"\x00")
+            except BlockingIOError:
+                pass  # The loop already has wakeups it hasn't read yet
+
+    def run(self):
+        self.thread = threading.current_thread()
+
+        self.listen_socket.setblocking(False)
+        self.selector.register(self.listen_socket, selectors.EVENT_READ)
+        self.selector.register(self.wake_reader,   selectors.EVENT_READ)
+
+        while self.server.running:
+            for key, events in self.selector.select(timeout=1):
+                if key.fileobj is self.listen_socket:
+                    self.accept()
+                elif key.fileobj is self.wake_reader:
+                    self.drain_wakeups()
+                else:
+                    if events & selectors.EVENT_WRITE:
+                        self.flush(key.data)
+                    if events & selectors.EVENT_READ:
+                        self.read(key.data)
+
+            self.process_pending()
+
+        for connection in list(self.connections.values()):
+            self.drop(connection)
+
+        self.selector.close()
+        self.wake_reader.close()
+        self.wake_writer.close()
+
+    def accept(self):
+        while True:
+            try:
+                sock, address = self.listen_socket.accept()
+            except BlockingIOError:
+                return
+
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            connection = SelectorConnection(self, sock, address, self.server.send_queue_limit)
+            self.connections[sock.fileno()] = connection
+            self.selector.register(sock, selectors.EVENT_READ, connection)
+
+            self.server.logger.info(f"{address} connected to the server")
+
+    def drain_wakeups(self):
+        try:
+            while self.wake_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def process_pending(self):
+        # Flushing can queue more data (a dropped player's despawn packets for example), so keep going until nothing is left
+        while self.pending:
+            with self.pending_lock:
+                pending, self.pending = self.pending, set()
+
+            for connection in pending:
+                if connection.socket.fileno() in self.connections:
+                    self.flush(connection)
+
+    def read(self, connection):
+        if connection.socket.fileno() not in self.connections or connection.closing:
+            return
+
+        try:
+            connection.receive.fill(connection.socket)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.drop(connection)
+            return
+
+        try:
+            self.server.handle_received(connection)
+        except (OSError, ValueError):
+            connection.close()
+        except Exception:
+            self.server.logger.exception(f"Error while handling packets from {connection.address}")
+            connection.close()
+
+    def flush(self, connection):
+        with connection.lock:
+            try:
+                if connection.outbound:
+                    # Everything queued so far goes out in a single send
+                    sent = connection.socket.send(connection.outbound)
+                    del connection.outbound[:sent]
+
+                    connection.bytes_sent += sent
+                    connection.sends      += 1
+            except BlockingIOError:
+                pass
+            except OSError:
+                connection.outbound.clear()
+                connection.closing = True
+
+            waiting = bool(connection.outbound)
+
+        if connection.closing and not waiting:
+            self.drop(connection)
+        else:
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE if waiting else selectors.EVENT_READ
+            self.selector.modify(connection.socket, events, connection)
+
+    def drop(self, connection):
+        fileno = connection.socket.fileno()
+
+        if fileno not in self.connections:
+            return
+
+        del self.connections[fileno]
+        self.selector.unregister(connection.socket)
+        connection.closing = True
+
+        if connection.overflowed:
+            self.server.logger.warning(f"{connection.address} was disconnected because its send queue passed {connection.queue_limit} bytes")
+
+        if connection.player is not None:
+            self.server.logout_player(connection.player)
+
+        connection.socket.close()
@@ -1,11 +1,11 @@
+import collections
 import struct
-import typing
 
-class InvalidPacketError(Exception):
+class InvalidPacketError(ValueError):
     pass
 
 def string_to_bytes(string):
-    return f"{string: <64}".encode("cp437")
+    return string.encode("cp437").ljust(64)
 
 def bytes_to_string(string):
     return string.decode("cp437").strip()
@@ -41,41 +41,85 @@ SIZES = {
 }
 
 class Packet:
-    def __init__(self, packet_id: int, augment: str):
+    def __init__(self, packet_id: int, name: str, augment: str, fields: str = ""):
         self.packet_id = packet_id
+        self.name      = name
         self.augment   = "!" + augment
         self.size      = get_size(self.augment)
+        self.struct    = struct.Struct(self.augment)  # Compiled once so packing doesn't re-parse the format string every time
+        self.tuple     = collections.namedtuple(name, ["packet_id"] + fields.split())
+        self.strings   = tuple(i for i, field in enumerate(augment.split(" ")[1:]) if field + " " == STRING)  # [1:] skips the packet ID
 
-    def to_bytes(self, *args):
-        return struct.pack(self.augment, self.packet_id, *[
-            string_to_bytes(i) if isinstance(i, str) else i
-            for i in args
-        ])
-
-    def from_bytes(self, data) -> list[typing.Any]:
-        if data[0] != self.packet_id:
-            raise InvalidPacketError(f"First byte of the packet must be {self.packet_id} but it's {data[0]}")
-        
-        return [bytes_to_string(i) if isinstance(i, bytes) and len(i) == 64 else i
-                for i in struct.unpack(self.augment, data)]
-
-player_identification_packet         = Packet(packet_id=0x00, augment=BYTE + BYTE + STRING + STRING + BYTE)
-server_identification_packet         = Packet(packet_id=0x00, augment=BYTE + BYTE + STRING + STRING + BYTE)
-ping_packet                          = Packet(packet_id=0x01, augment=BYTE)
-level_initilize_packet               = Packet(packet_id=0x02, augment=BYTE)
-level_data_chunk_packet              = Packet(packet_id=0x03, augment=BYTE + SIGNED_SHORT + BYTE_ARRAY + BYTE)
-level_finalize_packet                = Packet(packet_id=0x04, augment=BYTE + SIGNED_SHORT + SIGNED_SHORT + SIGNED_SHORT)
-client_set_block_packet              = Packet(packet_id=0x05, augment=BYTE + SIGNED_SHORT + SIGNED_SHORT + SIGNED_SHORT + BYTE + BYTE)
-server_set_block_packet              = Packet(packet_id=0x06, augment=BYTE + SIGNED_SHORT + SIGNED_SHORT + SIGNED_SHORT + BYTE)
-spawn_player_packet                  = Packet(packet_id=0x07, augment=BYTE + BYTE + STRING + SIGNED_SHORT + SIGNED_SHORT + SIGNED_SHORT + BYTE + BYTE)
-position_orientation_packet          = Packet(packet_id=0x08, augment=BYTE + BYTE + SIGNED_SHORT + SIGNED_SHORT + SIGNED_SHORT + BYTE + BYTE)
-relative_position_orientation_packet = Packet(packet_id=0x09, augment=BYTE + BYTE + BYTE + BYTE + BYTE + BYTE + BYTE)
-relative_position_packet             = Packet(packet_id=0x0a, augment=BYTE + BYTE + BYTE + BYTE + BYTE + BYTE + BYTE)
-relative_orientation_packet          = Packet(packet_id=0x0b, augment=BYTE + BYTE + BYTE + BYTE)
-despawn_player_packet                = Packet(packet_id=0x0c, augment=BYTE + BYTE)  
-message_packet                       = Packet(packet_id=0x0d, augment=BYTE + BYTE + STRING)
-disconnect_packet                    = Packet(packet_id=0x0e, augment=BYTE + STRING)
-change_player_type_packet            = Packet(packet_id=0x0f, augment=BYTE + BYTE)
+    def to_bytes(self, *args) -> bytes:
+        if self.strings:
+            args = list(args)
+
+            for i in self.strings:
+                args[i] = string_to_bytes(args[i])
+
+        return self.struct.pack(self.packet_id, *args)
+
+    def pack_into(self, buffer, offset: int, *args):
+        if self.strings:
+            args = list(args)
+
+            for i in self.strings:
+                args[i] = string_to_bytes(args[i])
+
+        self.struct.pack_into(buffer, offset, self.packet_id, *args)
+
+    def from_bytes(self, data) -> tuple:
+        return self.unpack_from(data, 0)
+
+    def unpack_from(self, buffer, offset: int = 0) -> tuple:
+        # buffer can be a memoryview over a receive buffer, nothing but the decoded fields gets copied
+        if buffer[offset] != self.packet_id:
+            raise InvalidPacketError(f"First byte of the packet must be {self.packet_id} but it's {buffer[offset]}")
+
+        values = self.struct.unpack_from(buffer, offset)
+
+        if self.strings:
+            values = list(values)
+
+            for i in self.strings:
+                values[i + 1] = bytes_to_string(values[i + 1])
+
+        return self.tuple._make(values)
+
+player_identification_packet         = Packet(packet_id=0x00, name="PlayerIdentification",        augment=BYTE + BYTE + STRING + STRING + BYTE,                                                     fields="protocol_version username verification_key unused")
+server_identification_packet         = Packet(packet_id=0x00, name="ServerIdentification",        augment=BYTE + BYTE + STRING + STRING + BYTE,                                                     fields="protocol_version server_name server_motd user_type")
+ping_packet                          = Packet(packet_id=0x01, name="Ping",                        augment=BYTE)
+level_initilize_packet               = Packet(packet_id=0x02, name="LevelInitialize",             augment=BYTE)
+level_data_chunk_packet              = Packet(packet_id=0x03, name="LevelDataChunk",              augment=BYTE + SIGNED_SHORT + BYTE_ARRAY + BYTE,                                                  fields="chunk_length chunk_data percent_complete")
+level_finalize_packet                = Packet(packet_id=0x04, name="LevelFinalize",               augment=BYTE + SIGNED_SHORT + SIGNED_SHORT + SIGNED_SHORT,                                        fields="width height length")
+client_set_block_packet              = Packet(packet_id=0x05, name="ClientSetBlock",              augment=BYTE + SIGNED_SHORT + SIGNED_SHORT + SIGNED_SHORT + BYTE + BYTE,                          fields="x y z mode block_type")
+server_set_block_packet              = Packet(packet_id=0x06, name="ServerSetBlock",              augment=BYTE + SIGNED_SHORT + SIGNED_SHORT + SIGNED_SHORT + BYTE,                                 fields="x y z block_type")
+spawn_player_packet                  = Packet(packet_id=0x07, name="SpawnPlayer",                 augment=BYTE + BYTE + STRING + SIGNED_SHORT + SIGNED_SHORT + SIGNED_SHORT + BYTE + BYTE,          fields="player_id name x y z yaw pitch")
+position_orientation_packet          = Packet(packet_id=0x08, name="PositionOrientation",         augment=BYTE + BYTE + SIGNED_SHORT + SIGNED_SHORT + SIGNED_SHORT + BYTE + BYTE,                   fields="player_id x y z yaw pitch")
+relative_position_orientation_packet = Packet(packet_id=0x09, name="RelativePositionOrientation", augment=BYTE + BYTE + FIXED_POINT_BYTE + FIXED_POINT_BYTE + FIXED_POINT_BYTE + BYTE + BYTE,       fields="player_id dx dy dz yaw pitch")
+relative_position_packet             = Packet(packet_id=0x0a, name="RelativePosition",            augment=BYTE + BYTE + FIXED_POINT_BYTE + FIXED_POINT_BYTE + FIXED_POINT_BYTE,                     fields="player_id dx dy dz")
+relative_orientation_packet          = Packet(packet_id=0x0b, name="RelativeOrientation",         augment=BYTE + BYTE + BYTE + BYTE,                                                                fields="player_id yaw pitch")
+despawn_player_packet                = Packet(packet_id=0x0c, name="DespawnPlayer",               augment=BYTE + BYTE,                                                                              fields="player_id")
+message_packet                       = Packet(packet_id=0x0d, name="Message",                     augment=BYTE + BYTE + STRING,                                                                     fields="player_id message")
+disconnect_packet                    = Packet(packet_id=0x0e, name="Disconnect",                  augment=BYTE + STRING,                                                                            fields="reason")
+change_player_type_packet            = Packet(packet_id=0x0f, name="ChangePlayerType",            augment=BYTE + BYTE,                                                                              fields="user_type")
+
+def movement_update(player_id: int, old: tuple, new: tuple) -> bytes:
+    # old and new are (x, y, z, yaw, pitch) in fixed point units, the smallest packet that can describe the change is used
+    dx, dy, dz = new[0] - old[0], new[1] - old[1], new[2] - old[2]
+    moved      = dx or dy or dz
+    turned     = new[3] != old[3] or new[4] != old[4]
+
+    if not -128 <= dx <= 127 or not -128 <= dy <= 127 or not -128 <= dz <= 127:
+        return position_orientation_packet.to_bytes(player_id, *new)
+    elif moved and turned:
+        return relative_position_orientation_packet.to_bytes(player_id, dx, dy, dz, new[3], new[4])
+    elif moved:
+        return relative_position_packet.to_bytes(player_id, dx, dy, dz)
+    elif turned:
+        return relative_orientation_packet.to_bytes(player_id, new[3], new[4])
+    else:
+        return b""
 
 client_packets = {
     0x00: player_identification_packet,
@@ -0,0 +1,224 @@
+import heapq
+import threading
+
+import block
+
+AIR     = block.air_block.block_id
+STONE   = block.stone_block.block_id
+WATER   = block.water_block.block_id
+LAVA    = block.lava_block.block_id
+
+FALLING = {block.sand_block.block_id, block.gravel_block.block_id}
+FLUIDS  = {WATER, LAVA}
+WET     = {WATER, block.still_water.block_id}
+HOT     = {LAVA,  block.still_lava.block_id}
+
+FALLS_THROUGH = {AIR} | WET | HOT
+
+# Ticks between a block becoming active and it doing something
+DELAYS = {
+    block.sand_block.block_id:   1,
+    block.gravel_block.block_id: 1,
+    WATER:                       5,
+    LAVA:                        30,
+}
+
+def table(ids):
+    # A bytes.translate table that turns the block IDs in ids into 1 and everything else into 0
+    return bytes(1 if i in ids else 0 for i in range(256))
+
+IS_FALLING  = table(FALLING)
+IS_THROUGH  = table(FALLS_THROUGH)
+IS_WATER    = table({WATER})
+IS_LAVA     = table({LAVA})
+WATER_FLOWS = table({AIR} | HOT)  # What flowing water next to a block does something to it
+LAVA_FLOWS  = table({AIR} | WET)
+
+def mask(data, ids_table) -> int:
+    # One byte per block, 1 where it's in the table. As an integer, so masks of whole rows can be combined with & and |
+    return int.from_bytes(data.translate(ids_table), "big")
+
+def shifted(blocks, start: int, end: int, offset: int) -> bytes:
+    # The blocks offset away from start:end, with stone, which never does anything, past either end of the world
+    low, high = start + offset, end + offset
+    length    = end - start
+    data      = bytes(blocks[max(low, 0):max(min(high, len(blocks)), 0)])
+    before    = min(max(-low, 0), length)
+
+    return bytes([STONE]) * before + data + bytes([STONE]) * (length - before - len(data))
+
+def positions(bits: int, start: int, length: int):
+    data  = bits.to_bytes(length, "big")
+    found = []
+    i     = data.find(1)
+
+    while i != -1:
+        found.append(start + i)
+        i = data.find(1, i + 1)
+
+    return found
+
+class Physics:
+    def __init__(self, server):
+        self.server    = server
+        self.budget    = 4096  # Active blocks updated per tick, whatever's left over waits for the next tick
+
+        self.lock      = threading.Lock()
+        self.queues    = {}    # World name -> heap of (tick it's due, block index), only blocks that can still do something are in it
+        self.scheduled = {}    # World name -> the block indexes in its heap, so a block is never in it twice
+        self.updates   = 0
+
+    def active(self):
+        return sum(len(i) for i in self.scheduled.values())
+
+    def schedule(self, world_name, index, block_id):
+        if block_id not in DELAYS:
+            return
+
+        scheduled = self.scheduled.setdefault(world_name, set())
+
+        if index not in scheduled:
+            scheduled.add(index)
+            heapq.heappush(self.queues.setdefault(world_name, []), (self.server.ticks + DELAYS[block_id], index))
+
+    def block_changed(self, this_world, index):
+        # Called after something other than physics changed a block, wakes it up along with whatever around it could now move
+        with self.lock:
+            self.schedule(this_world.name, index, this_world.blocks[index])
+            self.wake_neighbours(this_world, index)
+
+    def rows_changed(self, this_world, rows):
+        # block_changed for a bulk edit, rows are the (start index, old blocks, new blocks) translate_region hands back.
+        # Waking every edited block would flood the queue, so each row is compared with the rows next to it instead, and only the blocks
+        # in it or around it that can actually move are scheduled. That's worked out before taking the lock, so ticks aren't held up
+        layer = this_world.width * this_world.length
+        sides = (-1, 1, -this_world.width, this_world.width)
+        woken = []
+
+        for start, old, _ in rows:
+            end  = start + len(old)
+            here = bytes(this_world.blocks[start:end])
+
+            # Edited blocks that can move: falling ones with nothing under them, and fluids next to something they flow into
+            open_water = open_lava = 0
+
+            for offset in sides + (-layer,):
+                nearby      = shifted(this_world.blocks, start, end, offset)
+                open_water |= mask(nearby, WATER_FLOWS)
+                open_lava  |= mask(nearby, LAVA_FLOWS)
+
+            bits   = mask(here, IS_FALLING) & mask(shifted(this_world.blocks, start, end, -layer), IS_THROUGH)
+            bits  |= mask(here, IS_WATER) & open_water | mask(here, IS_LAVA) & open_lava
+            woken += positions(bits, start, end - start)
+
+            # Blocks around the edit that can now move into it: falling ones above a hole, and fluids next to one, except from below
+            bits   = mask(shifted(this_world.blocks, start, end, layer), IS_FALLING) & mask(here, IS_THROUGH)
+            woken += positions(bits, start + layer, end - start)
+
+            for offset in sides + (layer,):
+                nearby = shifted(this_world.blocks, start, end, offset)
+                bits   = mask(nearby, IS_WATER) & mask(here, WATER_FLOWS) | mask(nearby, IS_LAVA) & mask(here, LAVA_FLOWS)
+                woken += positions(bits, start + offset, end - start)
+
+        with self.lock:
+            for index in woken:
+                self.schedule(this_world.name, index, this_world.blocks[index])
+
+    def forget(self, world_name):
+        with self.lock:
+            self.queues.pop(world_name, None)
+            self.scheduled.pop(world_name, None)
+
+    def neighbours(self, this_world, index):
+        layer   = this_world.width * this_world.length
+        y, rest = divmod(index, layer)
+        z, x    = divmod(rest, this_world.width)
+
+        if y > 0:                      yield index - layer
+        if x > 0:                      yield index - 1
+        if x < this_world.width  - 1:  yield index + 1
+        if z > 0:                      yield index - this_world.width
+        if z < this_world.length - 1:  yield index + this_world.width
+        if y < this_world.height - 1:  yield index + layer
+
+    def wake_neighbours(self, this_world, index):
+        new = this_world.blocks[index]
+
+        if new == AIR:
+            # A hole can be flowed into from the sides or above, and fallen into from above
+            for i in self.neighbours(this_world, index):
+                self.schedule(this_world.name, i, this_world.blocks[i])
+        elif new in FALLS_THROUGH:
+            above = index + this_world.width * this_world.length
+
+            if above < len(this_world.blocks) and this_world.blocks[above] in FALLING:
+                self.schedule(this_world.name, above, this_world.blocks[above])
+
+    def set(self, this_world, index, block_id, changed):
+        this_world.set_block(*this_world.position(index), block_id)
+        changed[index] = block_id  # Only the last change to a block in a tick gets sent
+
+        self.wake_neighbours(this_world, index)
+
+    def tick(self):
+        with self.lock:
+            if not self.queues:
+                return
+
+            # Every world with something going on gets the same share, so one flooded world can't stop the rest
+            share = max(1, self.budget // len(self.queues))
+
+            for world_name in list(self.queues):
+                this_world = self.server.loaded_worlds.get(world_name)
+
+                if this_world is None:
+                    del self.queues[world_name]
+                    del self.scheduled[world_name]
+                    continue
+
+                queue     = self.queues[world_name]
+                scheduled = self.scheduled[world_name]
+                changed   = {}
+                done      = 0
+
+                while queue and queue[0][0] <= self.server.ticks and done < share:
+                    _, index = heapq.heappop(queue)
+                    scheduled.discard(index)
+
+                    self.update(this_world, index, changed)
+                    done += 1
+
+                self.updates += done
+
+                if not queue:
+                    del self.queues[world_name]
+                    del self.scheduled[world_name]
+
+                self.server.send_block_changes(world_name, list(changed.items()))
+
+    def update(self, this_world, index, changed):
+        block_id = this_world.blocks[index]
+
+        if block_id in FALLING:
+            below = index - this_world.width * this_world.length
+
+            if below >= 0 and this_world.blocks[below] in FALLS_THROUGH:
+                self.set(this_world, below, block_id, changed)
+                self.set(this_world, index, AIR,      changed)
+                self.schedule(this_world.name, below, block_id)
+
+        elif block_id in FLUIDS:
+            above = index + this_world.width * this_world.length
+
+            for i in self.neighbours(this_world, index):
+                if i == above:
+                    continue
+
+                other = this_world.blocks[i]
+
+                if other == AIR:
+                    self.set(this_world, i, block_id, changed)
+                    self.schedule(this_world.name, i, block_id)
+                elif (block_id == WATER and other in HOT) or (block_id == LAVA and other in WET):
+                    # Water and lava touching turn into stone, which is also what stops a flood of either
+                    self.set(this_world, i, STONE, changed)
@@ -2,6 +2,18 @@ import packet
 import struct
 import rank
 
+def message_bytes(msg: str) -> bytes:
+    # The message packets for a chat line, lines longer than a packet are continued in the next ones after a "> "
+    data = []
+
+    while len(msg) > 64:
+        data.append(packet.message_packet.to_bytes(0, msg[:64]))
+        msg = "> " + msg[64:]
+
+    data.append(packet.message_packet.to_bytes(0, msg))
+
+    return b"".join(data)
+
 class Player:
     FORMAT_VERSION = 1
     
@@ -12,11 +24,16 @@ class Player:
         self.connection              = connection
 
         self.player_id               = 0
+        self.uid                     = 0   # Permanent ID from the player store, player_id is only for this session
         self.world                   = ""
         
         self.x                       = 0
         self.y                       = 0
         self.z                       = 0
+        self.yaw                     = 0
+        self.pitch                   = 0
+        self.sent_position           = (0, 0, 0, 0, 0)  # The position and orientation other players last got, in fixed point units
+        self.viewers                 = set()            # IDs of the players this player is spawned for (and that are spawned for this player)
 
         self.logins                  = 0
         self.blocks_mined            = 0
@@ -26,55 +43,14 @@ class Player:
         self.c_packets = dict(packet.client_packets)
         self.s_packets = dict(packet.server_packets)
     
-    def format_r(self, text):
-        return text.replace("§nme", self.username) \
-                   .replace("§nck", self.username) \
-                   .replace("§clr", "&7") \
-                   .replace("§lim", "Connected") \
-                   .replace("§lom", "Disconnected") \
-                   .replace("§rnm", self.rank.name) \
-                   .replace("§rcl", self.rank.color) \
-                   .replace("§rnb", str(self.rank.num))
-
-    
-    def format_s(self, text):
-        return text.replace("§snm", self.username) \
-                   .replace("§snk", self.username) \
-                   .replace("§scl", "&7") \
-                   .replace("§sli", "Connected") \
-                   .replace("§slo", "Disconnected") \
-                   .replace("§srn", self.rank.name) \
-                   .replace("§src", self.rank.color) \
-                   .replace("§srb", str(self.rank.num))
+    def position(self):
+        return (int(self.x * 32), int(self.y * 32), int(self.z * 32), self.yaw, self.pitch)
 
     def send_bytes(self, data):
         self.connection.send(data)
     
-    def read_packet(self) -> tuple:
-        packet_id = int.from_bytes(self.read_bytes(1), byteorder = "big")
-        
-        if packet_id in self.c_packets:
-            packet_  = self.c_packets[packet_id]
-            return packet_.from_bytes(packet_id.to_bytes(1, byteorder="big", signed=False) + self.read_bytes(packet_.size - 1))
-        else:
-            self.send_bytes(packet.disconnect_packet.to_bytes(f"Invalid packet {packet_id}!"))
-            return tuple()
-        
-    def read_bytes(self, num):
-        data = self.connection.recv(num)
-
-        while len(data) < num:
-            data += self.connection.recv(num)
-
-        return data
-
     def _message(self, msg:str):
-        if len(msg) > 64:
-            self._message(msg[:64])
-            self._message("> " + msg[64:])
-            return
-
-        self.send_bytes(packet.message_packet.to_bytes(0, msg))
+        self.send_bytes(message_bytes(msg))
 
     def to_bytes(self):
         return struct.pack("!B 64s h i i i", self.FORMAT_VERSION, self.username.encode("cp437"), self.rank.num, self.logins, self.blocks_mined, self.blocks_placed)
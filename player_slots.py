@@ -0,0 +1,54 @@
+import collections
+import threading
+
+class SlotAllocator:
+    SIZE = 128  # Player IDs are signed bytes on the wire and negative ones mean the player themselves
+
+    def __init__(self, limit=None):
+        self.limit    = limit  # Most slots players can hold at once, None means as many as there are IDs
+
+        self.lock     = threading.Lock()
+        self.free     = collections.deque(range(self.SIZE))  # Released IDs go to the back, so an ID isn't handed out again right after it was freed
+        self.used     = bytearray(self.SIZE)
+        self.reserved = set()  # IDs that never go to players, like the console's
+        self.in_use   = 0
+
+        self.acquired = 0
+        self.released = 0
+        self.refused  = 0
+        self.peak     = 0
+
+    def reserve(self, player_id):
+        with self.lock:
+            if self.used[player_id]:
+                raise ValueError(f"Player ID {player_id} is already in use")
+
+            self.free.remove(player_id)
+            self.used[player_id] = 1
+            self.reserved.add(player_id)
+
+    def acquire(self):
+        # Returns a free player ID, or None if the server is full
+        with self.lock:
+            if not self.free or (self.limit is not None and self.in_use >= self.limit):
+                self.refused += 1
+                return None
+
+            player_id = self.free.popleft()
+
+            self.used[player_id] = 1
+            self.in_use   += 1
+            self.acquired += 1
+            self.peak      = max(self.peak, self.in_use)
+
+            return player_id
+
+    def release(self, player_id):
+        with self.lock:
+            if not self.used[player_id] or player_id in self.reserved:
+                raise ValueError(f"Player ID {player_id} isn't held by a player")
+
+            self.used[player_id] = 0
+            self.free.append(player_id)
+            self.in_use   -= 1
+            self.released += 1
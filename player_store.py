@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import threading
+
+import player
+
+class PlayerStore:
+    def __init__(self, folder: str, flush_interval: float = 5):
+        self.folder         = folder
+        self.path           = f"{folder}/players.db"
+        self.flush_interval = flush_interval
+
+        self.database       = None
+        self.lock           = threading.Lock()
+        self.ids            = {}  # Username -> player ID of every registered player, so checking if someone exists never hits the disk
+        self.names          = {}  # Player ID -> username
+        self.pending        = {}  # Username -> Player.to_bytes() of saves that haven't been written yet
+        self.next_id        = 1
+
+    def open(self):
+        migrate = not os.path.exists(self.path)
+
+        self.database = sqlite3.connect(self.path, check_same_thread=False)
+        self.database.execute("PRAGMA journal_mode=WAL")
+        self.database.execute("CREATE TABLE IF NOT EXISTS players (id INTEGER PRIMARY KEY, username TEXT UNIQUE NOT NULL, data BLOB NOT NULL)")
+
+        if migrate:
+            self.migrate()
+
+        self.ids     = dict(self.database.execute("SELECT username, id FROM players"))
+        self.names   = {uid: name for name, uid in self.ids.items()}
+        self.next_id = max(self.ids.values(), default=0) + 1
+
+    def migrate(self):
+        # One-shot import of the files players used to be saved as, one per player named after them.
+        # The files are left where they are, the database existing is what stops this from running again
+        rows = []
+
+        for name in os.listdir(self.folder):
+            path = f"{self.folder}/{name}"
+
+            if not os.path.isfile(path) or name.startswith("players.db"):
+                continue
+
+            with open(path, "rb") as f:
+                data = f.read()
+
+            if data[:1] == bytes([player.Player.FORMAT_VERSION]):
+                rows.append((name, data))
+
+        with self.database:
+            self.database.executemany("INSERT INTO players (username, data) VALUES (?, ?)", rows)
+
+    def exists(self, name) -> bool:
+        return name in self.ids
+
+    def register(self, this_player):
+        # New players get their ID straight away, their first save creates the row
+        with self.lock:
+            if this_player.username not in self.ids:
+                self.ids[this_player.username] = self.next_id
+                self.names[self.next_id]       = this_player.username
+                self.next_id += 1
+
+            this_player.uid = self.ids[this_player.username]
+
+    def load(self, name, ranks) -> player.Player:
+        # Returns None for a name that was registered but never saved
+        with self.lock:
+            if name in self.pending:
+                data = self.pending[name]
+            else:
+                row = self.database.execute("SELECT data FROM players WHERE username = ?", (name,)).fetchone()
+
+                if row is None:
+                    return None
+
+                data = row[0]
+
+        this_player     = player.Player.from_bytes(data, ranks)
+        this_player.uid = self.ids[name]
+
+        return this_player
+
+    def save(self, this_player):
+        # Only queued here, flush() writes everything queued in one transaction
+        self.register(this_player)
+
+        with self.lock:
+            self.pending[this_player.username] = this_player.to_bytes()
+
+    def flush(self) -> int:
+        with self.lock:
+            if not self.pending:
+                return 0
+
+            rows = [(self.ids[name], name, data) for name, data in self.pending.items()]
+
+            with self.database:
+                self.database.executemany("INSERT INTO players (id, username, data) VALUES (?, ?, ?) "
+                                          "ON CONFLICT(id) DO UPDATE SET data = excluded.data", rows)
+
+            self.pending.clear()
+
+        return len(rows)
+
+    def close(self):
+        self.flush()
+        self.database.close()
@@ -0,0 +1,222 @@
+import contextlib
+import graphlib
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+class PluginManager:
+    MODULE_PREFIX = "plugins."
+
+    def __init__(self, server):
+        self.server     = server
+        self.plugins    = {}     # Plugin name -> its Plugin object
+        self.modules    = {}     # Plugin name -> the module it was loaded from, each plugin gets its own
+        self.owned      = {}     # Plugin name -> names of the commands it added
+        self.handlers   = {}     # Plugin name -> (event type, handler) of everything it subscribed
+        self.load_times = {}     # Plugin name -> seconds its last load took
+        self.lock       = threading.RLock()
+        self.staging    = threading.local()
+
+    def path(self, name):
+        return f"{self.server.plugins_folder}/{name}.py"
+
+    def valid(self, name) -> bool:
+        # Names that could point outside the plugins folder are never plugins
+        return bool(name) and not name.startswith(".") and "/" not in name and "\\" not in name
+
+    def available(self):
+        return sorted(i[:-3] for i in os.listdir(self.server.plugins_folder) if i.endswith(".py"))
+
+    def import_module(self, name):
+        # Goes through the normal source loader, so unchanged plugins are loaded from their cached bytecode in __pycache__
+        spec   = importlib.util.spec_from_file_location(self.MODULE_PREFIX + name, self.path(name))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        return module
+
+    def dependencies(self, module):
+        return tuple(getattr(module.Plugin, "depends", ()))
+
+    @contextlib.contextmanager
+    def capture(self, commands, added, handlers):
+        # While this is active, commands added or removed by this thread go into commands instead of the server's,
+        # the names of added ones are collected in added, and event subscriptions are held back in handlers
+        self.staging.commands = commands
+        self.staging.added    = added
+        self.staging.handlers = handlers
+
+        try:
+            yield
+        finally:
+            self.staging.commands = None
+            self.staging.added    = None
+            self.staging.handlers = None
+
+    def commands(self):
+        # Where add_command and remove_command should write to right now
+        commands = getattr(self.staging, "commands", None)
+
+        return self.server.commands if commands is None else commands
+
+    def added(self, name):
+        added = getattr(self.staging, "added", None)
+
+        if added is not None:
+            added.add(name)
+
+    def subscribe(self, event_type, handler, priority):
+        handlers = getattr(self.staging, "handlers", None)
+
+        if handlers is None:
+            self.server.events.subscribe(event_type, handler, priority)
+        else:
+            handlers.append((event_type, handler, priority))
+
+    def unsubscribe(self, event_type, handler):
+        handlers = getattr(self.staging, "handlers", None)
+
+        if handlers is None:
+            self.server.events.unsubscribe(event_type, handler)
+        else:
+            handlers[:] = [i for i in handlers if i[:2] != (event_type, handler)]
+
+    def load_all(self):
+        # Imports every plugin first, then creates them in dependency order. Returns plugin name -> error for the ones that failed
+        errors  = {}
+        modules = {}
+
+        for name in self.available():
+            if name in self.plugins:
+                continue
+
+            try:
+                started       = time.perf_counter()
+                modules[name] = self.import_module(name)
+                self.load_times[name] = time.perf_counter() - started
+            except Exception as e:
+                errors[name] = repr(e)
+
+        graph = {name: [i for i in self.dependencies(module) if i not in self.plugins] for name, module in modules.items()}
+
+        try:
+            order = list(graphlib.TopologicalSorter(graph).static_order())
+        except graphlib.CycleError as e:
+            for name in e.args[1]:
+                errors[name] = f"Circular plugin dependency: {' -> '.join(e.args[1])}"
+            order = [name for name in modules if name not in errors]
+
+        for name in order:
+            if name not in modules or name in errors:
+                continue
+
+            missing = [i for i in self.dependencies(modules[name]) if i not in self.plugins]
+
+            if missing:
+                errors[name] = f"Missing dependencies: {', '.join(missing)}"
+                continue
+
+            error = self.start(name, modules[name])
+
+            if error:
+                errors[name] = error
+
+        for name, error in errors.items():
+            self.server.logger.error(f"Failed to load plugin {name}: {error}")
+
+        return errors
+
+    def load(self, name) -> str:
+        # Loads one plugin, or reloads it if it's loaded already. Returns an error message, or "" if it worked
+        if not self.valid(name):
+            return f"Invalid plugin name \"{name}\""
+
+        if not os.path.exists(self.path(name)):
+            return f"File \"{self.path(name)}\" not found"
+
+        try:
+            started = time.perf_counter()
+            module  = self.import_module(name)
+            self.load_times[name] = time.perf_counter() - started
+        except Exception as e:
+            return repr(e)
+
+        missing = [i for i in self.dependencies(module) if i not in self.plugins]
+
+        if missing:
+            return f"Missing dependencies: {', '.join(missing)}"
+
+        return self.start(name, module)
+
+    def start(self, name, module) -> str:
+        # The new commands are put together in a copy of the command table and swapped in with one assignment, so players
+        # never see half a plugin, and a plugin that fails to start leaves whatever was loaded before it untouched
+        with self.lock:
+            started  = time.perf_counter()
+            old      = self.plugins.get(name)
+            staged   = dict(self.server.commands)
+            added    = set()
+            handlers = []
+
+            for i in self.owned.get(name, ()):
+                staged.pop(i, None)
+
+            try:
+                with self.capture(staged, added, handlers):
+                    plugin = module.Plugin(server=self.server)
+            except Exception as e:
+                return repr(e)
+
+            if old is not None:
+                # The old plugin cleans up after itself in a throwaway table, its commands are already gone from the staged one
+                try:
+                    with self.capture(dict(self.server.commands), set(), []):
+                        old.unload()
+                except Exception:
+                    self.server.logger.exception(f"Error while unloading the old version of plugin {name}")
+
+            self.server.commands = staged
+
+            # The old plugin's handlers are replaced right after its commands
+            self.unsubscribe_all(name)
+
+            for event_type, handler, priority in handlers:
+                self.server.events.subscribe(event_type, handler, priority)
+
+            self.plugins[name]     = plugin
+            self.modules[name]     = module
+            self.owned[name]       = added
+            self.handlers[name]    = [i[:2] for i in handlers]
+            sys.modules[module.__name__] = module
+
+            self.load_times[name] += time.perf_counter() - started
+            self.server.logger.info(f"{'Reloaded' if old is not None else 'Loaded'} plugin {name} in {self.load_times[name] * 1000:.1f}ms")
+
+        return ""
+
+    def unload(self, name):
+        with self.lock:
+            dependents = [i for i, module in self.modules.items() if name in self.dependencies(module)]
+
+            if dependents:
+                raise ValueError(f"Plugin {name} is needed by {', '.join(dependents)}")
+
+            self.plugins[name].unload()
+
+            # Anything the plugin forgot to remove goes too
+            for i in self.owned.pop(name, ()):
+                self.server.commands.pop(i, None)
+
+            self.unsubscribe_all(name)
+
+            del self.plugins[name]
+            sys.modules.pop(self.modules.pop(name).__name__, None)
+
+    def unsubscribe_all(self, name):
+        for event_type, handler in self.handlers.pop(name, ()):
+            try:
+                self.server.events.unsubscribe(event_type, handler)
+            except ValueError:
+                pass  # The plugin already unsubscribed it itself
@@ -1,6 +1,11 @@
+import random
+import time
+
+import block
 import command
 import packet
 import constants
+import world_generator
 
 class Plugin:
     name = "CorePlugin"
@@ -20,10 +25,22 @@ class Plugin:
         self.server.add_command(command.Command("players",       self.players_command,      self.players_command_help,          constants.RANK_GUEST))
         self.server.add_command(command.Command("blocks",        self.blocks_command,       self.blocks_command_help,           constants.RANK_GUEST))
         self.server.add_command(command.Command("goto",          self.goto_command,         self.goto_command_help,             constants.RANK_GUEST))
-        #self.server.add_command(command.Command("overseer",     self.overseer_command,     self.overseer_command_help,        constants.RANK_GUEST))
+        self.server.add_command(command.Command("overseer",      self.overseer_command,     self.overseer_command_help,         constants.RANK_GUEST))
         self.server.add_command(command.Command("save_all",      self.save_all_command,     self.save_all_command_help,         constants.RANK_OPERATOR))
         self.server.add_command(command.Command("ranks",         self.ranks_command,        self.ranks_command_help,            constants.RANK_GUEST))
         self.server.add_command(command.Command("about_player",  self.about_player_command, self.about_player_command_help,     constants.RANK_GUEST))
+        self.server.add_command(command.Command("netstats",      self.netstats_command,     self.netstats_command_help,         constants.RANK_OPERATOR))
+        self.server.add_command(command.Command("stats",         self.stats_command,        self.stats_command_help,            constants.RANK_GUEST))
+        self.server.add_command(command.Command("cuboid",        self.cuboid_command,       self.cuboid_command_help,           constants.RANK_BUILDER))
+        self.server.add_command(command.Command("fill",          self.fill_command,         self.fill_command_help,             constants.RANK_BUILDER))
+        self.server.add_command(command.Command("replace",       self.replace_command,      self.replace_command_help,          constants.RANK_BUILDER))
+        self.server.add_command(command.Command("outline",       self.outline_command,      self.outline_command_help,          constants.RANK_BUILDER))
+        self.server.add_command(command.Command("undo",          self.undo_command,         self.undo_command_help,             constants.RANK_GUEST))
+        self.server.add_command(command.Command("redo",          self.redo_command,         self.redo_command_help,             constants.RANK_GUEST))
+        self.server.add_command(command.Command("rollback",      self.rollback_command,     self.rollback_command_help,         constants.RANK_OPERATOR))
+        self.server.add_command(command.Command("block_history", self.block_history_command, self.block_history_command_help,  constants.RANK_BUILDER))
+        self.server.add_command(command.Command("plugins",       self.plugins_command,      self.plugins_command_help,          constants.RANK_GUEST))
+        self.server.add_command(command.Command("reload",        self.reload_command,       self.reload_command_help,           constants.RANK_OPERATOR))
 
     def unload(self):
         self.server.logger.info("Unloading plugin")
@@ -33,9 +50,22 @@ class Plugin:
         self.server.remove_command("players")
         self.server.remove_command("blocks")
         self.server.remove_command("goto")
+        self.server.remove_command("overseer")
         self.server.remove_command("save_all")
         self.server.remove_command("ranks")
         self.server.remove_command("about_player")
+        self.server.remove_command("netstats")
+        self.server.remove_command("stats")
+        self.server.remove_command("cuboid")
+        self.server.remove_command("fill")
+        self.server.remove_command("replace")
+        self.server.remove_command("outline")
+        self.server.remove_command("undo")
+        self.server.remove_command("redo")
+        self.server.remove_command("rollback")
+        self.server.remove_command("block_history")
+        self.server.remove_command("plugins")
+        self.server.remove_command("reload")
     
     help_command_help = "§errSeriously?"
 
@@ -159,13 +189,54 @@ class Plugin:
         that = None
         if args[0] in self.server.online_players:
             that = self.server.online_players[args[0]]
-        else:
+        elif self.server.player_saved(args[0]):
             that = self.server.load_player(args[0])
+        else:
+            player.message(f"§errUnknown player §nms{args[0]}")
+            return
 
         player.message(f"§nms{that.username}§dft has:")
         player.message(f"§dft  Rank of {that.rank.color}{that.rank.name}")
         player.message(f"§dft  Has been on the server §nms{that.logins}§dft times and is currently {'&coffline' if that.connection is None else '&aonline'}")
     
+    netstats_command_help = "§cmd/netstats §dft- shows how much data is waiting to be sent to each player"
+
+    def netstats_command(self, player, args):
+        players = sorted(self.server.online_players.values(), key=lambda p: p.connection.queue_depth, reverse=True)
+
+        player.message(f"§nms{len(players)} §dftplayers, send queue limit is §arg{self.server.send_queue_limit} §dftbytes:")
+
+        for i in players:
+            player.message(f"§nms{i.username}§dft: §arg{i.connection.queue_depth} §dftqueued, §arg{i.connection.peak_queue} §dftpeak, §arg{i.connection.bytes_sent} §dftsent in §arg{i.connection.sends} §dftwrites")
+    
+    stats_command_help = "§cmd/stats §dft- shows how the server is performing"
+
+    def stats_command(self, player, args):
+        tick_times = list(self.server.tick_times)
+
+        player.message(f"§dftServer has run §arg{self.server.ticks} §dftticks at §arg{self.server.tps} §dftTPS (§arg{1000 / self.server.tps:.0f}ms §dftbudget)")
+
+        if tick_times:
+            player.message(f"§dftTick time: §arg{sum(tick_times) / len(tick_times) * 1000:.2f}ms §dftavg, §arg{max(tick_times) * 1000:.2f}ms §dftmax over the last §arg{len(tick_times)} §dftticks")
+
+        slots = self.server.player_slots
+        player.message(f"§dftSlots: §arg{slots.in_use}§dft/§arg{slots.limit} §dftused, §arg{slots.peak} §dftpeak, §arg{slots.acquired} §dftjoins, §arg{slots.released} §dftleaves, §arg{slots.refused} §dftrefused")
+        player.message(f"§dftPhysics: §arg{self.server.physics.active()} §dftactive blocks, §arg{self.server.physics.updates} §dftupdates")
+
+        stats = self.server.packet_stats
+
+        with stats.lock:
+            packet_ids = sorted(stats.counts)
+
+        for packet_id in packet_ids:
+            name = packet.client_packets[packet_id].name if packet_id in packet.client_packets else packet_id
+            player.message(f"§dft{name}: §arg{stats.counts[packet_id]}§dft, avg §arg{stats.times[packet_id] / stats.counts[packet_id] / 1000:.1f}us§dft, p99 §arg{stats.percentile(packet_id, 0.99) / 1000:.0f}us")
+        player.message(f"§dftWorlds: §arg{len(self.server.loaded_worlds)} §dftloaded using §arg{self.server.world_manager.memory_usage() // 1048576}MiB §dftof §arg{self.server.world_manager.memory_limit // 1048576}MiB§dft, §arg{self.server.world_manager.unloaded} §dftunloaded")
+
+        if self.server.save_stats:
+            name, written, snapshot_time, write_time = self.server.save_stats[-1]
+            player.message(f"§dftLast save: §nms{name}§dft, §arg{written} §dftbytes, snapshot §arg{snapshot_time * 1000:.1f}ms§dft, write §arg{write_time * 1000:.1f}ms")
+    
     goto_command_help = "§cmd/goto §arg[map name] §dft- goes to a map"
 
     def goto_command(self, player, args):
@@ -179,34 +250,279 @@ class Plugin:
             player.message(f"§errInvalid world §nms{args[0]}")
             return
         
-        for k, v in dict(self.server.online_players).items():
-            if v.player_id != player.player_id and v.world == player.world:
-                v.send_packet(packet.DespawnPlayerPacket(player.player_id))
-                player.send_packet(packet.DespawnPlayerPacket(v.player_id))
-        
-        this_world = self.server.get_world(args[0])
-        this_world.send(player)
-        player.world = args[0]
-        
-        for k, v in dict(self.server.online_players).items():
-            if v.player_id != player.player_id and v.world == player.world:
-                v.send_packet(packet.SpawnPlayerPacket(player.player_id, player.username, player.x, player.y, player.z, 0, 0))
-                player.send_packet(packet.SpawnPlayerPacket(v.player_id, v.username, v.x, v.y, v.z, 0, 0))
+        self.server.change_world(player, args[0])
+
+    overseer_command_help = "§cmd/overseer §dft- creates your own world and takes you there once it's ready"
+
+    def overseer_command(self, player, args):
+        if self.server.world_exists(player.username):
+            player.message(f"§errWorld §nms{player.username} §erralready exists")
+            return
 
-    #overseer_command_help = "§cmd/overseer §dft- ..."
+        generator = world_generator.generators["perlin" if world_generator.numpy is not None else "flat"]
+        reported  = [0]
+
+        def progress(done, total):
+            # Only every quarter, so a map made of a lot of chunks doesn't flood the chat
+            if done * 4 // total > reported[0]:
+                reported[0] = done * 4 // total
+                player.message(f"§dftGenerating §nms{player.username}§dft: §arg{done * 100 // total}%")
+
+        def finished(future):
+            if future.exception() is not None:
+                self.server.logger.error(f"Couldn't create world {player.username}: {future.exception()}")
+                player.message(f"§errCouldn't create your world")
+            elif player.username in self.server.online_players:
+                self.server.change_world(player, player.username)
+
+        try:
+            future = self.server.make_world_async(player.username, 256, 128, 256, generator=generator, seed=random.getrandbits(32), progress=progress)
+        except ValueError:
+            player.message(f"§errWorld §nms{player.username} §erris already being created")
+            return
 
-    #def overseer_command(self, player, args):
-        #args = args.split(", ")
-        ##if len(args) == 0:
-        ##    player.message("§cmd/overseer §dft- ...")
-        #
-        #if self.server.world_exists(player.username):
-        #    player.message(f"§errWorld §nms{player.username} §erralready exists")
-        #
-        #self.server.make_world(player.username, 128, 128, 128)
+        player.message(f"§dftCreating §nms{player.username}§dft, you'll be taken there when it's ready")
+        future.add_done_callback(finished)
 
-    save_all_command_help = "§cmd/save_all §dft- ..."
+    save_all_command_help = "§cmd/save_all §dft- saves every world with unsaved changes"
 
     def save_all_command(self, player, args):
-        for i in self.server.loaded_worlds:
-            self.server.save_world(i)
+        futures = self.server.save_worlds_in_background()
+
+        player.message(f"§dftSaving §arg{len(futures)} §dftworlds in the background")
+
+    def parse_block(self, name):
+        if name.isdigit():
+            return int(name) if int(name) in self.server.blocks else None
+
+        for i in self.server.blocks.values():
+            if i.name.lower() == name.lower():
+                return i.block_id
+
+        return None
+
+    def parse_draw(self, player, args, usage, block_count):
+        # Argument checking shared by the drawing commands: two corners, then block_count block names or IDs
+        args = args.split(", ")
+
+        if len(args) != 6 + block_count:
+            player.message(usage)
+            return None
+
+        try:
+            corners = [int(i) for i in args[:6]]
+        except ValueError:
+            player.message(usage)
+            return None
+
+        if player.world not in self.server.loaded_worlds:
+            player.message("§errYou aren't in a world")
+            return None
+
+        this_world = self.server.loaded_worlds[player.world]
+
+        if not this_world.contains(*corners[:3]) or not this_world.contains(*corners[3:]):
+            player.message(f"§errThe corners have to be inside of §nms{this_world.name} §err({this_world.width}x{this_world.height}x{this_world.length})")
+            return None
+
+        block_ids = []
+        for i in args[6:]:
+            block_id = self.parse_block(i)
+
+            if block_id is None:
+                player.message(f"§errUnknown block §arg{i}")
+                return None
+
+            if self.server.block_registry.permissions(player.rank.num)[block_id] != block.PERMISSION_ALLOWED:
+                player.message(f"§errYou can't place §arg{self.server.blocks[block_id].name}")
+                return None
+
+            block_ids.append(block_id)
+
+        volume = (abs(corners[3] - corners[0]) + 1) * (abs(corners[4] - corners[1]) + 1) * (abs(corners[5] - corners[2]) + 1)
+
+        if volume > player.rank.max_draw:
+            player.message(f"§errThat's §arg{volume} §errblocks, you can only draw §arg{player.rank.max_draw} §errat once")
+            return None
+
+        return corners, block_ids
+
+    def draw_table(self, player, table):
+        # Blocks the player's rank can't break translate to themselves, so drawing over them leaves them where they are
+        permissions = self.server.block_registry.permissions(player.rank.num)
+
+        return bytes(i if permissions[i] == block.PERMISSION_DENIED else table[i] for i in range(256))
+
+    def draw(self, player, boxes, table):
+        self.report(player, self.server.edit_regions(player.world, boxes, self.draw_table(player, table), player.uid), lambda count: f"§dftChanged §arg{count} §dftblocks")
+
+    def report(self, player, future, message):
+        # Edits run on the server's edit thread, the player gets message(how many blocks changed) once it's done
+        world_name = player.world
+
+        def finished(future):
+            if future.exception() is not None:
+                self.server.logger.error(f"Couldn't edit {world_name} for {player.username}: {future.exception()}")
+                player.message("§errCouldn't change the blocks")
+            else:
+                player.message(message(future.result()))
+
+        future.add_done_callback(finished)
+
+    cuboid_command_help = "§cmd/cuboid §arg[x1], [y1], [z1], [x2], [y2], [z2], [block] §dft- fills a box with a block"
+
+    def cuboid_command(self, player, args):
+        parsed = self.parse_draw(player, args, self.cuboid_command_help, 1)
+        if parsed is None:
+            return
+
+        corners, (block_id,) = parsed
+
+        self.draw(player, [corners], bytes([block_id]) * 256)
+
+    fill_command_help = "§cmd/fill §arg[x1], [y1], [z1], [x2], [y2], [z2], [block] §dft- fills the air in a box with a block"
+
+    def fill_command(self, player, args):
+        parsed = self.parse_draw(player, args, self.fill_command_help, 1)
+        if parsed is None:
+            return
+
+        corners, (block_id,) = parsed
+
+        table    = bytearray(range(256))
+        table[0] = block_id
+
+        self.draw(player, [corners], table)
+
+    replace_command_help = "§cmd/replace §arg[x1], [y1], [z1], [x2], [y2], [z2], [block], [new block] §dft- replaces one block with another in a box"
+
+    def replace_command(self, player, args):
+        parsed = self.parse_draw(player, args, self.replace_command_help, 2)
+        if parsed is None:
+            return
+
+        corners, (old_id, new_id) = parsed
+
+        table         = bytearray(range(256))
+        table[old_id] = new_id
+
+        self.draw(player, [corners], table)
+
+    outline_command_help = "§cmd/outline §arg[x1], [y1], [z1], [x2], [y2], [z2], [block] §dft- builds the walls, floor and ceiling of a box"
+
+    def outline_command(self, player, args):
+        parsed = self.parse_draw(player, args, self.outline_command_help, 1)
+        if parsed is None:
+            return
+
+        corners, (block_id,) = parsed
+
+        x1, x2 = min(corners[0], corners[3]), max(corners[0], corners[3])
+        y1, y2 = min(corners[1], corners[4]), max(corners[1], corners[4])
+        z1, z2 = min(corners[2], corners[5]), max(corners[2], corners[5])
+
+        # The six faces overlap at the edges, which only means those blocks get set twice
+        faces = [(x1, y1, z1, x2, y1, z2), (x1, y2, z1, x2, y2, z2),
+                 (x1, y1, z1, x2, y2, z1), (x1, y1, z2, x2, y2, z2),
+                 (x1, y1, z1, x1, y2, z2), (x2, y1, z1, x2, y2, z2)]
+
+        self.draw(player, faces, bytes([block_id]) * 256)
+
+    undo_command_help = "§cmd/undo §arg[count] §dft- undoes your last edits in this world, 1 by default. A drawing command is one edit"
+
+    def undo_command(self, player, args):
+        self.undo_redo(player, args, self.undo_command_help, "undo")
+
+    redo_command_help = "§cmd/redo §arg[count] §dft- puts back edits you undid, 1 by default"
+
+    def redo_command(self, player, args):
+        self.undo_redo(player, args, self.redo_command_help, "redo")
+
+    def undo_redo(self, player, args, usage, action):
+        if args == "":
+            count = 1
+        elif args.isdigit():
+            count = int(args)
+        else:
+            player.message(usage)
+            return
+
+        if player.world not in self.server.loaded_worlds:
+            player.message("§errYou aren't in a world")
+            return
+
+        future = self.server.edit_world(player.world, lambda this_world: getattr(self.server.history.get(this_world), action)(this_world, player.uid, count))
+        self.report(player, future, lambda changed: f"§dftChanged §arg{changed} §dftblocks")
+
+    rollback_command_help = "§cmd/rollback §arg[player name], [time] §dft- reverts everything a player did in this world in the last [time], like 30s, 10m, 2h or 1d"
+
+    def rollback_command(self, player, args):
+        args  = args.split(", ")
+        units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+        if len(args) != 2 or not args[1][:-1].isdigit() or args[1][-1] not in units:
+            player.message(self.rollback_command_help)
+            return
+
+        if not self.server.player_saved(args[0]):
+            player.message(f"§errUnknown player §nms{args[0]}")
+            return
+
+        if player.world not in self.server.loaded_worlds:
+            player.message("§errYou aren't in a world")
+            return
+
+        since  = time.time() - int(args[1][:-1]) * units[args[1][-1]]
+        uid    = self.server.player_store.ids[args[0]]
+        future = self.server.edit_world(player.world, lambda this_world: self.server.history.get(this_world).rollback(this_world, uid, since, player.uid))
+
+        self.report(player, future, lambda changed: f"§dftRolled back §arg{changed} §dftblocks of §nms{args[0]}")
+
+    block_history_command_help = "§cmd/block_history §arg[x], [y], [z] §dft- shows who last changed a block"
+
+    def block_history_command(self, player, args):
+        args = args.split(", ")
+
+        if len(args) != 3 or not all(i.isdigit() for i in args):
+            player.message(self.block_history_command_help)
+            return
+
+        if player.world not in self.server.loaded_worlds:
+            player.message("§errYou aren't in a world")
+            return
+
+        this_world = self.server.loaded_worlds[player.world]
+        x, y, z    = (int(i) for i in args)
+
+        if not this_world.contains(x, y, z):
+            player.message(f"§errThat's outside of §nms{this_world.name}")
+            return
+
+        changes = self.server.history.get(this_world).changes_at(this_world.index(x, y, z), 5)
+
+        if not changes:
+            player.message("§dftNobody changed that block")
+
+        for change in changes:
+            name = self.server.player_store.names.get(change.uid, "?")
+            player.message(f"§nms{name} §dft{('placed', 'undid', 'redid', 'rolled back', 'placed')[change.kind]} §arg{self.server.blocks[change.new].name if change.new in self.server.blocks else change.new} §dft{time.time() - change.time:.0f}s ago")
+
+    plugins_command_help = "§cmd/plugins §dft- lists the loaded plugins and how long they took to load"
+
+    def plugins_command(self, player, args):
+        for name, plugin in self.server.loaded_plugins.items():
+            player.message(f"§nms{name} §dft({getattr(plugin, 'name', name)} by §nms{getattr(plugin, 'creator', '?')}§dft) - §arg{self.server.plugin_manager.load_times.get(name, 0) * 1000:.1f}ms")
+
+    reload_command_help = "§cmd/reload §arg[plugin name] §dft- loads a plugin again from its file, or for the first time"
+
+    def reload_command(self, player, args):
+        if args == "":
+            player.message(self.reload_command_help)
+            return
+
+        error = self.server.load_plugin(args)
+
+        if error:
+            player.message(f"§errCouldn't load §nms{args}§err: {error}")
+        else:
+            player.message(f"§dftLoaded §nms{args} §dftin §arg{self.server.plugin_manager.load_times[args] * 1000:.1f}ms")
@@ -0,0 +1,155 @@
+import re
+
+TOKEN    = re.compile(r"§([a-z]{3})|%msg%")
+SANITIZE = re.compile(r"\$ip|\$skin|Â")
+COLOR    = re.compile(r"&([0-9a-f])")
+
+# :trollface:
+SANITIZED = {
+    "$ip":   "I am an idiot and tried to use $ip",
+    "$skin": "I am an idiot and tried to use $skin",
+    "Â":     "",  # weird bug fix
+}
+
+# §xxx code -> the key in the colors section of server.toml it's replaced with
+SERVER_COLORS = {
+    "msg": "message",
+    "dft": "default",
+    "cmd": "commands",
+    "nms": "names",
+    "err": "errors",
+    "arg": "arguments",
+}
+
+# These will be replaced with the receiver's information
+FIELDS = {
+    "nme": lambda p: p.username,
+    "nck": lambda p: p.username,
+    "clr": lambda p: "&7",
+    "lim": lambda p: "Connected",
+    "lom": lambda p: "Disconnected",
+    "rnm": lambda p: p.rank.name,
+    "rcl": lambda p: p.rank.color,
+    "rnb": lambda p: str(p.rank.num),
+}
+
+# And these with the sender's, each one is the sender version of a receiver field
+SENDER_FIELDS = {
+    "snm": "nme",
+    "snk": "nck",
+    "scl": "clr",
+    "sli": "lim",
+    "slo": "lom",
+    "srn": "rnm",
+    "src": "rcl",
+    "srb": "rnb",
+}
+
+ANSI = {
+    "0": "\u001b[30m", "1": "\u001b[34m", "2": "\u001b[32m", "3": "\u001b[36m",
+    "4": "\u001b[31m", "5": "\u001b[35m", "6": "\u001b[33m", "7": "\u001b[97m",
+    "8": "\u001b[90m", "9": "\u001b[94m", "a": "\u001b[92m", "b": "\u001b[96m",
+    "c": "\u001b[91m", "d": "\u001b[95m", "e": "\u001b[93m", "f": "\u001b[97m",
+}
+
+MESSAGE = object()  # Where %msg% goes
+
+def sanitize(text: str) -> str:
+    return SANITIZE.sub(lambda match: SANITIZED[match[0]], text)
+
+def colorize(text: str) -> str:
+    # &x color codes to terminal colors
+    return COLOR.sub(lambda match: ANSI[match[1]], text) + "\u001b[0m"
+
+class Template:
+    def __init__(self, parts):
+        # Parts are plain strings, MESSAGE, or ("s" or "r", field, the text it was parsed from) for player fields.
+        # Strings next to each other are merged, so a template without fields or %msg% is a single string
+        self.parts = []
+
+        for part in parts:
+            if isinstance(part, str) and self.parts and isinstance(self.parts[-1], str):
+                self.parts[-1] += part
+            elif part != "":
+                self.parts.append(part)
+
+        self.text            = self.parts[0] if len(self.parts) == 1 and isinstance(self.parts[0], str) else "" if not self.parts else None
+        self.receiver_fields = tuple(sorted({part[1] for part in self.parts if isinstance(part, tuple) and part[0] == "r"}))
+
+    def fill(self, sender=None, message: str = None) -> "Template":
+        # Does everything that's the same for every receiver, so a broadcast only does it once
+        parts = []
+
+        for part in self.parts:
+            if part is MESSAGE:
+                parts.append("%msg%" if message is None else sanitize(message))
+            elif isinstance(part, tuple) and part[0] == "s":
+                parts.append(part[2] if sender is None else FIELDS[part[1]](sender))
+            else:
+                parts.append(part)
+
+        return Template(parts)
+
+    def view(self, receiver) -> tuple:
+        # Receivers with the same view get exactly the same text, for most templates that's everyone
+        return tuple(FIELDS[field](receiver) for field in self.receiver_fields)
+
+    def render(self, receiver=None) -> str:
+        if self.text is not None:
+            return self.text
+
+        text = []
+
+        for part in self.parts:
+            if isinstance(part, str):
+                text.append(part)
+            elif part is MESSAGE:
+                text.append("%msg%")
+            elif part[0] == "r" and receiver is not None:
+                text.append(FIELDS[part[1]](receiver))
+            else:
+                text.append(part[2])
+
+        return "".join(text)
+
+class TemplateEngine:
+    CACHE_SIZE = 4096
+
+    def __init__(self, colors):
+        self.colors = {code: colors[key] for code, key in SERVER_COLORS.items() if key in colors}
+        self.cache  = {}
+
+    def compile(self, text: str) -> Template:
+        template = self.cache.get(text)
+
+        if template is None:
+            if len(self.cache) >= self.CACHE_SIZE:
+                self.cache.clear()
+
+            template = self.cache[text] = Template(self.parse(text))
+
+        return template
+
+    def parse(self, text: str):
+        parts = []
+        last  = 0
+
+        for match in TOKEN.finditer(text):
+            parts.append(sanitize(text[last:match.start()]))
+            last = match.end()
+            code = match[1]
+
+            if code is None:
+                parts.append(MESSAGE)
+            elif code in self.colors:
+                parts.append(self.colors[code])
+            elif code in FIELDS:
+                parts.append(("r", code, match[0]))
+            elif code in SENDER_FIELDS:
+                parts.append(("s", SENDER_FIELDS[code], match[0]))
+            else:
+                parts.append(match[0])
+
+        parts.append(sanitize(text[last:]))
+
+        return parts
@@ -1,5 +1,7 @@
 import gzip
+import operator
 import struct
+import threading
 
 import player
 import packet
@@ -7,9 +9,12 @@ import block
 import world_generator
 
 class World:
-    FORMAT_VERSION = 1
+    FORMAT_VERSION = 3
+    JOURNAL_LIMIT  = 65536  # Region edits bigger than this many blocks are saved as a snapshot instead of journaled
+    EDIT_CHUNK     = 65536  # Most blocks a region edit changes at once, the lock is let go in between so single block changes aren't held up
+    COMPRESSION    = 4      # gzip level of the level stream, it's rebuilt after every edit so speed matters more than size
 
-    def __init__(self, width: int, height: int, length: int, name: str, motd="Welcome!", generator=world_generator.flat_world_generator):
+    def __init__(self, width: int, height: int, length: int, name: str, motd="Welcome!", generator=world_generator.flat_world_generator, seed=0):
         self.width  = width
         self.height = height
         self.length = length
@@ -17,61 +22,293 @@ class World:
         self.name   = name
         self.motd   = motd
     
-        self.blocks = bytearray(generator(self.width, self.height, self.length, 0))
+        self.blocks = bytearray(generator(self.width, self.height, self.length, seed))
+
+        self.version      = 0     # Bumped by every edit, so the cached level stream knows when it's out of date
+        self.level_cache  = None
+        self.level_lock   = threading.Lock()
+
+        self.mapping      = None  # The memory mapped file blocks is a view into, if it was loaded that way
+        self.generation   = 0     # Bumped for every snapshot, journals are only replayed over the snapshot with their generation
+
+        self.changes      = {}    # Block index -> block ID of everything edited since the last save
+        self.dirty_all    = False # Set when so much changed that writing a whole new snapshot is cheaper than journaling the changes
+        self.changes_lock = threading.Lock()
+    
+    def contains(self, x: int, y: int, z: int):
+        return 0 <= x < self.width and 0 <= y < self.height and 0 <= z < self.length
+
+    def index(self, x: int, y: int, z: int):
+        if not self.contains(x, y, z):
+            raise IndexError(f"Block ({x}, {y}, {z}) is outside of {self.name} ({self.width}x{self.height}x{self.length})")
+
+        return x + self.width * (z + self.length * y)  # The blocks are stored in XZY order
     
     def get_block(self, x: int, y: int, z: int):
-        index = x + (self.width * z) + (self.width * self.length * z)  # The blocks are stored in XZY order
-        return int.from_bytes(self.blocks[index:index + 1], byteorder="big")
+        return self.blocks[self.index(x, y, z)]
 
     def set_block(self, x: int, y: int, z: int, block_id: block.block_id_type):
-        index = x + (self.width * z) + (self.width * self.length * z)  # The blocks are stored in XZY order
-        self.blocks[index*2:index*2+1] = bytearray(block_id.to_bytes(2, byteorder="big", signed=False))
+        index = self.index(x, y, z)
+
+        with self.changes_lock:
+            self.blocks[index] = block_id
+            self.version += 1
+
+            if not self.dirty_all:
+                self.changes[index] = block_id
+
+    def region_rows(self, x1: int, y1: int, z1: int, x2: int, y2: int, z2: int):
+        # (start, end) index ranges covering the box between the two corners, rows that are next to each other in memory get merged
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+        z1, z2 = min(z1, z2), max(z1, z2)
+
+        self.index(x1, y1, z1)
+        self.index(x2, y2, z2)
+
+        layer = self.width * self.length
+
+        if x2 - x1 + 1 == self.width and z2 - z1 + 1 == self.length:
+            return [(y1 * layer, (y2 + 1) * layer)]
+        elif x2 - x1 + 1 == self.width:
+            return [(self.width * (z1 + self.length * y), self.width * (z2 + 1 + self.length * y)) for y in range(y1, y2 + 1)]
+        else:
+            return [(x1 + self.width * (z + self.length * y), x2 + 1 + self.width * (z + self.length * y)) for y in range(y1, y2 + 1) for z in range(z1, z2 + 1)]
+
+    def get_region(self, x1: int, y1: int, z1: int, x2: int, y2: int, z2: int) -> bytes:
+        return b"".join(self.blocks[start:end] for start, end in self.region_rows(x1, y1, z1, x2, y2, z2))
+
+    def set_region(self, x1: int, y1: int, z1: int, x2: int, y2: int, z2: int, data):
+        # data is either one block ID for the whole box, or the new blocks in the same XZY order get_region returns them in
+        rows = self.region_rows(x1, y1, z1, x2, y2, z2)
+
+        with self.changes_lock:
+            self.write_rows(rows, data)
+            self.record_rows(rows)
+
+    def translate_region(self, x1: int, y1: int, z1: int, x2: int, y2: int, z2: int, table: bytes, limit: int = None, edited: list = None):
+        # Runs every block in the box through table (a 256 byte bytes.translate table), one row at a time.
+        # Returns how many blocks changed and the (index, block ID) of each of them, or None instead of the list once more than limit changed.
+        # edited, if given, gets the (start index, old blocks, new blocks) of every row that changed, limit or not
+        rows    = self.region_rows(x1, y1, z1, x2, y2, z2)
+        total   = sum(end - start for start, end in rows)
+        count   = 0
+        changed = []
+
+        for row in rows:
+            for start in range(row[0], row[1], self.EDIT_CHUNK):
+                end = min(start + self.EDIT_CHUNK, row[1])
+
+                with self.changes_lock:
+                    old = bytes(self.blocks[start:end])
+                    new = old.translate(table)
+
+                    if new == old:
+                        continue
+
+                    self.blocks[start:end] = new
+                    self.record_rows([(start, end)], total)
+
+                count += sum(map(operator.ne, old, new))
+
+                if edited is not None:
+                    edited.append((start, old, new))
+
+                if changed is None:
+                    continue
+
+                if limit is not None and count > limit:
+                    changed = None
+                else:
+                    changed.extend((start + i, b) for i, (a, b) in enumerate(zip(old, new)) if a != b)
+
+        return count, changed
+
+    def restore_rows(self, rows, edited: list) -> int:
+        # rows are (start index, expected blocks, replacement blocks). Every block that's still the expected one gets its replacement,
+        # the rest are left alone. Like translate_region, the lock is let go every EDIT_CHUNK blocks and the changed rows go into edited.
+        # Returns how many blocks changed
+        total = sum(len(expected) for _, expected, _ in rows)
+        count = 0
+
+        for row_start, expected, replacement in rows:
+            for offset in range(0, len(expected), self.EDIT_CHUNK):
+                start = row_start + offset
+                end   = start + min(self.EDIT_CHUNK, len(expected) - offset)
+                want  = expected[offset:offset + self.EDIT_CHUNK]
+                put   = replacement[offset:offset + self.EDIT_CHUNK]
+
+                with self.changes_lock:
+                    old = bytes(self.blocks[start:end])
+                    new = put if old == want else bytes(r if o == w else o for o, w, r in zip(old, want, put))
+
+                    if new == old:
+                        continue
+
+                    self.blocks[start:end] = new
+                    self.record_rows([(start, end)], total)
+
+                count += sum(map(operator.ne, old, new))
+                edited.append((start, old, new))
+
+        return count
+
+    def record_rows(self, rows, total: int = None):
+        # total is the size of the whole edit rows are part of, when it's recorded a piece at a time
+        self.version += 1
+
+        if total is None:
+            total = sum(end - start for start, end in rows)
+
+        if self.dirty_all or total > self.JOURNAL_LIMIT:
+            self.changes.clear()
+            self.dirty_all = True
+        else:
+            for start, end in rows:
+                self.changes.update(zip(range(start, end), self.blocks[start:end]))
+
+    def position(self, index: int):
+        # The (x, y, z) of a block index, the opposite of index()
+        y, rest = divmod(index, self.width * self.length)
+        z, x    = divmod(rest, self.width)
+
+        return x, y, z
+
+    def write_rows(self, rows, data):
+        if isinstance(data, int):
+            longest = max(end - start for start, end in rows)
+            fill    = bytes([data]) * longest
+
+            for start, end in rows:
+                self.blocks[start:end] = fill[:end - start]
+        else:
+            data   = memoryview(data)
+            offset = 0
+
+            if len(data) != sum(end - start for start, end in rows):
+                raise ValueError(f"Expected {sum(end - start for start, end in rows)} blocks but got {len(data)}")
+
+            for start, end in rows:
+                self.blocks[start:end] = data[offset:offset + end - start]
+                offset += end - start
+
+    def take_changes(self):
+        # Hands the changes made since the last call to whoever is saving the world, and starts tracking from scratch
+        with self.changes_lock:
+            changes, dirty_all = self.changes, self.dirty_all
+            self.changes       = {}
+            self.dirty_all     = False
+
+        return changes, dirty_all
+
+    @property
+    def dirty(self):
+        return self.dirty_all or bool(self.changes)
+
+    def memory_size(self):
+        # An unedited memory mapped world only counts its level stream, the mapped pages are page cache the OS can drop when it needs to.
+        # Edited pages are private memory, and which ones were edited isn't tracked, so an edited world counts in full
+        size = 0 if self.mapping is not None and self.version == 0 else len(self.blocks)
+
+        if self.level_cache is not None:
+            size += len(self.level_cache[1])
+
+        return size
+
+    def unmap(self):
+        # Copies the blocks out of the mapped file, so a new snapshot can replace it. Windows can't replace a file that's mapped
+        with self.changes_lock:
+            if self.mapping is None:
+                return
+
+            view, mapping = self.blocks, self.mapping
+            self.blocks   = bytearray(view)
+            self.mapping  = None
+
+        try:
+            view.release()
+            mapping.close()
+        except BufferError:
+            pass  # Something still has a view into it, the file is unmapped once that's gone
+
+    def close(self):
+        if self.mapping is not None:
+            self.blocks.release()
+            self.mapping.close()
+            self.mapping = None
     
     def send(self, player: player.Player):
         player.send_bytes(packet.server_identification_packet.to_bytes(7, self.name, self.motd, 0x64))
         player.send_bytes(packet.level_initilize_packet.to_bytes())
-
-        data = (self.width * self.height * self.length).to_bytes(4, byteorder="big") \
-             + bytearray([i for i in self.blocks[1::2]])
-        
-        data = gzip.compress(data)
-
-        for i in range(0, len(data), 1024):
-            player.send_bytes(packet.level_data_chunk_packet.to_bytes(min(1024, len(data)-i), data[i:i+1023], 247))
-        
+        player.send_bytes(self.level_stream())
         player.send_bytes(packet.level_finalize_packet.to_bytes(self.width, self.height, self.length))
         player.send_bytes(packet.position_orientation_packet.to_bytes(255, self.width//2*32, (self.height//2*32)+51, self.length//2*32, 0, 0))
+
+        player.x = self.width  // 2
+        player.y = ((self.height // 2 * 32) + 51) / 32
+        player.z = self.length // 2
+
+    def level_stream(self):
+        # All the level data chunk packets, gzipped once and reused by every join until the world is edited.
+        # Holding the lock while building means players joining at the same time wait for one compression instead of doing their own
+        with self.level_lock:
+            if self.level_cache is None or self.level_cache[0] != self.version:
+                version = self.version
+
+                data = (self.width * self.height * self.length).to_bytes(4, byteorder="big") \
+                     + bytes(self.blocks)
+                
+                data = gzip.compress(data, compresslevel=self.COMPRESSION)
+
+                chunks = []
+                for i in range(0, len(data), 1024):
+                    chunk = data[i:i+1024]
+                    chunks.append(packet.level_data_chunk_packet.to_bytes(len(chunk), chunk, (i + len(chunk)) * 100 // len(data)))
+
+                self.level_cache = (version, b"".join(chunks))
+
+            return self.level_cache[1]
     
     def to_bytes(self):
-        return struct.pack("!B 64s 64s hhh", self.FORMAT_VERSION, self.name.encode("cp437"), self.motd.encode("cp437"),
-                                             self.width, self.height, self.length) \
+        return struct.pack("!B 64s 64s hhh I", self.FORMAT_VERSION, self.name.encode("cp437"), self.motd.encode("cp437"),
+                                               self.width, self.height, self.length, self.generation) \
                            + bytes(self.blocks)
 
     @classmethod
-    def from_bytes(cls, data):
+    def from_bytes(cls, data, copy=True):
+        # With copy=False the blocks are a view into data instead of a copy of it, only the current format can be used that way.
+        # Worlds from before version 3 have no generation, it's left as None for the world store to deal with
         format_version = data[0]
 
-        if format_version == 1:
+        if format_version in (1, 2, 3):
             name, motd, width, height, length = struct.unpack("!64s 64s hhh", data[1:135])
             name = name.decode("cp437").replace("\x00", " ").strip()
             motd = motd.decode("cp437").replace("\x00", " ").strip()
 
-            extra_data  = data[135+(width*height*length*2):]
+            volume = width * height * length
 
             this_world = cls(width=width, height=height, length=length, name=name, motd=motd, generator=lambda width, height, length, seed: b'')
-            this_world.blocks = bytearray(data[135:135+(width*height*length*2)])
-            #                                                               ^ 2 because every block ID is 2 bytes
+            start      = 135
+
+            if format_version == 3:
+                this_world.generation = struct.unpack("!I", data[135:139])[0]
+                start = 139
+            else:
+                this_world.generation = None
 
-            '''i = 0
-            while True:
-                position = int.from_bytes(extra_data[i:i+4], byteorder="big", signed=True)
+            if format_version == 1:
+                # Version 1 stored every block ID as 2 big endian bytes, only the low one was ever sent to clients
+                this_world.blocks    = bytearray(data[136:135+(volume*2):2])
+                this_world.dirty_all = True  # So the next save rewrites it in the current format
+            elif copy:
+                this_world.blocks = bytearray(data[start:start+volume])
+            else:
+                this_world.blocks = memoryview(data)[start:start+volume]
 
-                if position == -1:
-                    break
-                    
-                this_world.blocks[position].from_bytes_extra(extra_data[i+4:i+4+this_world.blocks[position].extra_data_size])'''
+            if len(this_world.blocks) != volume:
+                raise ValueError(f"World {name} should have {volume} blocks but only has {len(this_world.blocks)}")
             
             return this_world
         
         else:
-            raise ValueError(f"Unsuported format version {format_version}")
\ No newline at end of file
+            raise ValueError(f"Unsuported format version {format_version}")
@@ -1,8 +1,14 @@
 import random
 import math
+from concurrent import futures
+from multiprocessing import shared_memory
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 import block
-import world
 
 def interpolate(start, end, step: float) -> float:
     return start + step * (end - start)
@@ -46,24 +52,136 @@ def perlin_noise(x: float, y: float) -> float:
 
     return interpolate(ix0, ix1, sy)
 
-def empty_world_generator(width: int, height: int, length: int, seed: int) -> bytes:
-    return b'\x00\x00' * width * height * length
+PARALLEL_THRESHOLD = 16777216  # Maps with at least this many blocks are generated in chunks across the generation pool
 
-def flat_world_generator(width: int, height: int, length: int, seed: int) -> bytes:
-    return (b'\x00\x07' * width * length) + (b'\x00\x03' * width * (height // 2 - 2) * length) + (b'\x00\x05' * width * length) + (b'\x00\x00' * width * (height // 2) * length)
-'''
-def perlin_world_generator(width: int, height: int, length: int, seed: int) -> bytes:
-    r = []
-    
-    heightmap = [[perlin_noise(i/20, j/20)+0.5 for j in range(length) ] for i in range(width)]
+# Generators return the blocks of rows z1 to z2 of every layer, in the same XZY order as World, so a map can be generated in chunks.
+# Leaving out z1 and z2 generates the whole map
+
+def empty_world_generator(width: int, height: int, length: int, seed: int, z1: int = 0, z2: int = None) -> bytes:
+    z2 = length if z2 is None else z2
+    return b'\x00' * width * height * (z2 - z1)
+
+def flat_world_generator(width: int, height: int, length: int, seed: int, z1: int = 0, z2: int = None) -> bytes:
+    z2     = length if z2 is None else z2
+    layer  = width * (z2 - z1)
+    return (b'\x07' * layer) + (b'\x03' * layer * (height // 2 - 2)) + (b'\x05' * layer) + (b'\x00' * layer * (height - height // 2))
+
+def random_gradients(ix, iy, seed: int):
+    # random_gradient for whole arrays of grid points at once, wrapping at 64 bits like the hash is meant to
+    w = numpy.uint64(64)
+    s = numpy.uint64(32)
+    a = ix.astype(numpy.uint64) ^ numpy.uint64(seed & 0xFFFFFFFFFFFFFFFF)
+    b = iy.astype(numpy.uint64)
+    a *= numpy.uint64(3284157443)
+    b ^= a << s | a >> w-s
+    b *= numpy.uint64(1911520717)
+    a ^= b << s | b >> w-s
+    a *= numpy.uint64(2048419325)
+    r = (a >> numpy.uint64(11)).astype(numpy.float64) * (2 * math.pi / 2**53)
+
+    return numpy.cos(r), numpy.sin(r)
+
+def perlin_noise_map(width: int, z1: int, z2: int, scale: float, seed: int):
+    # Perlin noise for every column in rows z1 to z2 of a map, indexed [z, x] like the blocks are stored
+    x = numpy.arange(width)  / scale
+    y = numpy.arange(z1, z2) / scale
+
+    x0 = numpy.floor(x).astype(numpy.int64)
+    y0 = numpy.floor(y).astype(numpy.int64)
+
+    # One gradient per grid point the rows touch, looked up by every column inside that grid cell
+    grid_x, grid_y = numpy.meshgrid(numpy.arange(x0[-1] + 2), numpy.arange(y0[0], y0[-1] + 2))
+    gradient_x, gradient_y = random_gradients(grid_x, grid_y, seed)
+
+    dx = (x - x0)[numpy.newaxis, :]
+    dy = (y - y0)[:, numpy.newaxis]
+    ix = x0[numpy.newaxis, :]
+    iy = (y0 - y0[0])[:, numpy.newaxis]
+
+    n00 = gradient_x[iy,     ix    ] * dx       + gradient_y[iy,     ix    ] * dy
+    n10 = gradient_x[iy,     ix + 1] * (dx - 1) + gradient_y[iy,     ix + 1] * dy
+    n01 = gradient_x[iy + 1, ix    ] * dx       + gradient_y[iy + 1, ix    ] * (dy - 1)
+    n11 = gradient_x[iy + 1, ix + 1] * (dx - 1) + gradient_y[iy + 1, ix + 1] * (dy - 1)
+
+    # Smoothstep instead of the raw distance, so the grid lines don't show up as creases in the terrain
+    sx = dx * dx * (3 - 2 * dx)
+    sy = dy * dy * (3 - 2 * dy)
+
+    return interpolate(interpolate(n00, n10, sx), interpolate(n01, n11, sx), sy)
+
+def perlin_height_map(width: int, z1: int, z2: int, seed: int, octaves: int = 4, scale: float = 64, persistence: float = 0.5):
+    noise     = numpy.zeros((z2 - z1, width))
+    amplitude = 1.0
+    total     = 0.0
+
+    for octave in range(octaves):
+        noise     += perlin_noise_map(width, z1, z2, scale / 2**octave, seed + octave) * amplitude
+        total     += amplitude
+        amplitude *= persistence
+
+    return noise / total
+
+def perlin_world_generator(width: int, height: int, length: int, seed: int, z1: int = 0, z2: int = None, octaves: int = 4, scale: float = 64) -> bytes:
+    if numpy is None:
+        raise RuntimeError("The perlin world generator needs numpy")
+
+    z2          = length if z2 is None else z2
+    water_level = height // 2
+    surface     = water_level + (perlin_height_map(width, z1, z2, seed, octaves, scale) * height).astype(numpy.int32)
+    surface     = numpy.clip(surface, 1, height - 2)[numpy.newaxis, :, :]
+
+    y = numpy.arange(height, dtype=numpy.int32)[:, numpy.newaxis, numpy.newaxis]
+
+    # Built as a [y, z, x] array, so its bytes are already in the order World stores blocks in
+    blocks = numpy.zeros((height, z2 - z1, width), dtype=numpy.uint8)
+    blocks[y <  surface - 3]  = block.stone_block.block_id
+    blocks[(y >= surface - 3) & (y < surface)] = block.dirt_block.block_id
+    blocks[(y == surface) & (surface >= water_level)] = block.grass_block.block_id
+    blocks[(y == surface) & (surface <  water_level)] = block.dirt_block.block_id
+    blocks[(y >  surface) & (y < water_level)] = block.still_water.block_id
+    blocks[0] = block.bedrock_block.block_id
+
+    return blocks.tobytes()
+
+generators = {
+    "empty":  empty_world_generator,
+    "flat":   flat_world_generator,
+    "perlin": perlin_world_generator,
+}
+
+def generate_chunk(generator, shared_name: str, width: int, height: int, length: int, seed: int, z1: int, z2: int) -> int:
+    # Runs in a worker process, and writes its rows of every layer straight into the shared block buffer
+    data   = memoryview(generator(width, height, length, seed, z1, z2))
+    rows   = width * (z2 - z1)
+    shared = shared_memory.SharedMemory(name=shared_name)
+
+    try:
+        for y in range(height):
+            start = width * (z1 + length * y)
+            shared.buf[start:start + rows] = data[y * rows:(y + 1) * rows]
+    finally:
+        shared.close()
+
+    return z2 - z1
+
+def generate_parallel(pool, generator, width: int, height: int, length: int, seed: int, chunks: int, progress=None) -> bytearray:
+    # Splits the map into slabs of rows along z and has the pool generate them into shared memory, so the blocks
+    # are never pickled. progress is called with the rows done so far and the total every time a slab finishes
+    volume = width * height * length
+    shared = shared_memory.SharedMemory(create=True, size=volume)
+
+    try:
+        step = max(1, -(-length // chunks))
+        jobs = [pool.submit(generate_chunk, generator, shared.name, width, height, length, seed, z1, min(z1 + step, length)) for z1 in range(0, length, step)]
 
-    for i in range(height):
-        for j in range(length):
-            for k in range(width):
-                if (heightmap[k][j]*height)<i:
-                    r.append(1)
-                else:
-                    r.append(0)
+        done = 0
+        for job in futures.as_completed(jobs):
+            done += job.result()
 
-    return r'''
+            if progress is not None:
+                progress(done, length)
 
+        return bytearray(shared.buf[:volume])
+    finally:
+        shared.close()
+        shared.unlink()
@@ -0,0 +1,108 @@
+import time
+
+class WorldManager:
+    GRACE_PERIOD = 5  # Seconds a world is kept after being used no matter what, so a world someone is about to join can't get unloaded
+
+    def __init__(self, server):
+        self.server        = server
+        self.memory_limit  = 1073741824
+        self.idle_timeout  = 300
+        self.warm_worlds   = 3
+        self.last_used     = {}
+        self.unloaded      = 0
+
+    def touch(self, name):
+        with self.server.load_lock:
+            self.last_used[name] = time.monotonic()
+
+            if name in self.server.loaded_worlds:
+                self.server.loaded_worlds.move_to_end(name)
+
+    def memory_usage(self):
+        with self.server.load_lock:
+            loaded = list(self.server.loaded_worlds.values())
+
+        return sum(i.memory_size() for i in loaded)
+
+    def run(self):
+        while self.server.running:
+            time.sleep(self.GRACE_PERIOD)
+
+            try:
+                self.evict()
+            except Exception:
+                self.server.logger.exception("Error while unloading unused worlds")
+
+    def evict(self):
+        # Worlds nobody is in get unloaded once they've been idle for idle_timeout, except for the warm_worlds most recently used ones.
+        # Past the memory limit the least recently used empty worlds get unloaded regardless
+        now = time.monotonic()
+
+        # Only loaded_worlds needs a lock, a player can't join a world without touching it first, and unload checks for that
+        with self.server.load_lock:
+            unused = [name for name in self.server.loaded_worlds
+                      if name != self.server.server_config["server"]["main_world"]
+                      and not self.server.world_players.get(name)
+                      and not self.server.editing.get(name)
+                      and now - self.last_used.get(name, 0) > self.GRACE_PERIOD]
+
+        usage = self.memory_usage()
+        warm  = set(unused[-self.warm_worlds:]) if self.warm_worlds > 0 else set()
+
+        for name in unused:
+            idle = name not in warm and now - self.last_used.get(name, 0) > self.idle_timeout
+
+            if usage > self.memory_limit or idle:
+                with self.server.load_lock:
+                    this_world = self.server.loaded_worlds.get(name)
+
+                if this_world is None:
+                    continue
+
+                size = this_world.memory_size()
+
+                if self.unload(name):
+                    usage -= size
+
+    def unload(self, name) -> bool:
+        with self.server.load_lock:
+            this_world = self.server.loaded_worlds.get(name)
+            touched    = self.last_used.get(name)
+
+        if this_world is None:
+            return False
+
+        # Most of it is saved before taking the lock, so loading other worlds doesn't have to wait for it
+        self.save(this_world)
+
+        with self.server.load_lock:
+            if self.server.world_players.get(name) or self.server.editing.get(name) or self.last_used.get(name) != touched:
+                return False
+
+            del self.server.loaded_worlds[name]
+            self.last_used.pop(name, None)
+
+            # Whatever changed since then is saved before the lock is let go, so loading it again straight away can't read an outdated file.
+            # If that fails the world stays loaded, so the changes aren't lost and it's tried again later
+            try:
+                self.save(this_world)
+            except OSError:
+                self.server.loaded_worlds[name] = this_world
+                self.last_used[name]             = touched
+                raise
+
+        this_world.close()
+        self.server.history.close(name)
+        self.server.physics.forget(name)
+
+        self.unloaded += 1
+        self.server.logger.info(f"Unloaded world {name}")
+
+        return True
+
+    def save(self, this_world):
+        if this_world.dirty:
+            with self.server.save_lock:
+                future = self.server.submit_world_save(this_world)
+
+            future.result()
@@ -0,0 +1,144 @@
+import mmap
+import os
+import struct
+
+import world
+
+class WorldStore:
+    JOURNAL_HEADER = struct.Struct("!4sI")  # Magic, generation of the snapshot the journal belongs to
+    JOURNAL_MAGIC  = b"JRNL"
+    JOURNAL_RECORD = struct.Struct("!IB")   # Block index, block ID
+
+    def __init__(self, folder: str, compact_ratio: float = 0.25, mmap_threshold: int = 0):
+        self.folder         = folder
+        self.compact_ratio  = compact_ratio   # The journal gets folded into a new snapshot once it's this big compared to the world
+        self.mmap_threshold = mmap_threshold  # Snapshots at least this big are memory mapped instead of read, 0 never maps them
+
+    def snapshot_path(self, name):
+        return f"{self.folder}/{name}"
+
+    def journal_path(self, name):
+        return f"{self.folder}/{name}.journal"
+
+    def exists(self, name) -> bool:
+        # Names that could point outside the worlds folder, or at the store's own files, are never worlds
+        if not name or name.startswith(".") or "/" in name or "\\" in name or name.endswith((".journal", ".tmp", ".history")):
+            return False
+
+        return os.path.isfile(self.snapshot_path(name))
+
+    def load(self, name) -> world.World:
+        if self.mmap_threshold and os.path.getsize(self.snapshot_path(name)) >= self.mmap_threshold:
+            this_world = self.load_mapped(name)
+        else:
+            with open(self.snapshot_path(name), "rb") as f:
+                this_world = world.World.from_bytes(f.read())
+
+        if os.path.exists(self.journal_path(name)):
+            with open(self.journal_path(name), "rb") as f:
+                journal = f.read()
+
+            if this_world.generation is None:
+                pass  # Written before snapshots had generations, the journal doesn't have a header either
+            elif len(journal) >= self.JOURNAL_HEADER.size and self.JOURNAL_HEADER.unpack_from(journal) == (self.JOURNAL_MAGIC, this_world.generation):
+                journal = journal[self.JOURNAL_HEADER.size:]
+            else:
+                # Left behind by a crash after a newer snapshot replaced the one it belongs to, everything in it is in the snapshot already
+                journal = b""
+                os.remove(self.journal_path(name))
+
+            volume = len(this_world.blocks)
+            end    = len(journal) - len(journal) % self.JOURNAL_RECORD.size  # A crash can leave half a record at the end
+
+            for index, block_id in self.JOURNAL_RECORD.iter_unpack(journal[:end]):
+                if index < volume:
+                    this_world.blocks[index] = block_id
+
+            if end:
+                this_world.version += 1  # Counts as an edit, a mapped world's replayed pages aren't the file's anymore
+
+        if this_world.generation is None:
+            this_world.generation = 0
+            this_world.dirty_all  = True  # So the next save writes a snapshot with a generation, and removes the old journal
+
+        return this_world
+
+    def load_mapped(self, name) -> world.World:
+        # The file is mapped copy-on-write: pages are only read in once a block on them is used, edited pages become private
+        # memory and the file itself is never touched, new snapshots replace it through write_snapshot like always
+        with open(self.snapshot_path(name), "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        if mapping[0] != world.World.FORMAT_VERSION:
+            this_world = world.World.from_bytes(mapping)
+            mapping.close()
+            return this_world
+
+        this_world = world.World.from_bytes(mapping, copy=False)
+        this_world.mapping = mapping
+
+        return this_world
+
+    def create(self, this_world):
+        this_world.take_changes()
+        self.write_snapshot(this_world.name, this_world.to_bytes())
+
+    def save(self, this_world) -> int:
+        return self.write(self.prepare(this_world))
+
+    def prepare(self, this_world):
+        # The part of a save that has to look at the world. It only copies, so it's cheap enough to run next to gameplay,
+        # and everything slow happens in write(), which can run on another thread
+        changes, dirty_all = this_world.take_changes()
+
+        if dirty_all or self.journal_size(this_world.name) + len(changes) * self.JOURNAL_RECORD.size > len(this_world.blocks) * self.compact_ratio:
+            # Copied after taking the changes, so an edit made in between ends up in both the snapshot and the next journal
+            this_world.unmap()
+            this_world.generation += 1
+            return (this_world.name, this_world.to_bytes(), None, this_world.generation)
+
+        return (this_world.name, None, changes, this_world.generation)
+
+    def write(self, save) -> int:
+        # Returns how many bytes were written
+        name, snapshot, changes, generation = save
+
+        if snapshot is not None:
+            self.write_snapshot(name, snapshot)
+            return len(snapshot)
+
+        if not changes:
+            return 0
+
+        data = b"".join(self.JOURNAL_RECORD.pack(index, block_id) for index, block_id in changes.items())
+
+        with open(self.journal_path(name), "ab") as f:
+            if f.tell() == 0:
+                f.write(self.JOURNAL_HEADER.pack(self.JOURNAL_MAGIC, generation))
+
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        return len(data)
+
+    def journal_size(self, name):
+        try:
+            return os.path.getsize(self.journal_path(name))
+        except OSError:
+            return 0
+
+    def write_snapshot(self, name, data):
+        # The new snapshot only replaces the old one once it's completely on disk, so a crash leaves one or the other intact.
+        # If the old journal isn't removed afterwards it's ignored on load, its generation is older than the new snapshot's
+        temp_path = f"{self.snapshot_path(name)}.tmp"
+
+        with open(temp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp_path, self.snapshot_path(name))
+
+        if os.path.exists(self.journal_path(name)):
+            os.remove(self.journal_path(name))